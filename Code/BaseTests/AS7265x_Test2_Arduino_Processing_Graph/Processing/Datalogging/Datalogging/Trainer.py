@@ -1,22 +1,38 @@
+import os
+import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
-from sklearn.metrics import accuracy_score
+from sklearn.metrics import accuracy_score, make_scorer
 import joblib
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.svm import SVC
 
 # Load the dataset without assuming a header
-df = pd.read_csv('combined.csv', header=None)
+# Use the compacted dataset (unique spectra + sample_weight column, see SpectralTools/Compactor.py) if it exists
+if os.path.exists('combined_compacted.csv'):
+    df = pd.read_csv('combined_compacted.csv', header=None)
+    sample_weight = df.iloc[:, -1].values
+    df = df.iloc[:, :-1]
+    print(f"Training on {len(df)} unique spectra ({int(sample_weight.sum())} frames)")
+else:
+    df = pd.read_csv('combined.csv', header=None)
+    sample_weight = np.ones(len(df))
+
+# Route the sample weights to the classifiers and to the cross-validation scorer, so model selection
+# counts frames and not unique spectra (the scaler stays unweighted)
+sklearn.set_config(enable_metadata_routing=True)
+scoring = make_scorer(accuracy_score).set_score_request(sample_weight=True)
 
 # Split the dataset into features and target variable
 X = df.iloc[:, 1:]  # Assuming the first column is the label and the rest are features
 y = df.iloc[:, 0]
 
 # Split the data into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+X_train, X_test, y_train, y_test, w_train, w_test = train_test_split(X, y, sample_weight, test_size=0.2, random_state=42)
 
 # Define a list to store the best models
 best_models = []
@@ -51,19 +67,19 @@ models_params = [
 for model_param in models_params:
     # Create a pipeline with a scaler and the current model
     pipeline = Pipeline([
-        ('scaler', StandardScaler()),
-        ('clf', model_param['model'])
+        ('scaler', StandardScaler().set_fit_request(sample_weight=False)),
+        ('clf', model_param['model'].set_fit_request(sample_weight=True))
     ])
 
     # Use GridSearchCV to find the best parameters for the current model
-    grid_search = GridSearchCV(pipeline, model_param['params'], cv=5, scoring='accuracy')
-    grid_search.fit(X_train, y_train)
+    grid_search = GridSearchCV(pipeline, model_param['params'], cv=5, scoring=scoring)
+    grid_search.fit(X_train, y_train, sample_weight=w_train)
 
     # Predict on the test set
     y_pred = grid_search.predict(X_test)
 
-    # Calculate the accuracy
-    accuracy = accuracy_score(y_test, y_pred)
+    # Calculate the accuracy (weighted, so it counts frames and not unique spectra)
+    accuracy = accuracy_score(y_test, y_pred, sample_weight=w_test)
     print(f"Best parameters for {type(model_param['model']).__name__}: {grid_search.best_params_}")
     print(f"Accuracy: {accuracy}")
 
@@ -73,15 +73,26 @@
 #             print(f"{f + 1}. feature {indices[f]} ({importances[indices[f]]})")
 #         print("\n")
 
+import os
 import pandas as pd
 import numpy as np
+import sklearn
 from sklearn.model_selection import train_test_split, GridSearchCV
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score, make_scorer
 import joblib
 
 # Load dataset
-df = pd.read_csv('data.csv')
+# Use the compacted dataset (unique spectra + sample_weight column, see SpectralTools/Compactor.py) if it exists
+if os.path.exists('data_compacted.csv'):
+    df = pd.read_csv('data_compacted.csv', header=None)
+    sample_weight = df.iloc[:, -1].values
+    df = df.iloc[:, :-1]
+    df.columns = df.columns.astype(str)
+    print(f"Training on {len(df)} unique spectra ({int(sample_weight.sum())} frames)")
+else:
+    df = pd.read_csv('data.csv')
+    sample_weight = np.ones(len(df))
 
 # Assuming the last column is the target and the rest are features
 X = df.iloc[:, :-1]  # Features
@@ -96,7 +107,7 @@ X['max'] = X.max(axis=1)
 X['range'] = X['max'] - X['min']
 
 # Split the dataset into training and testing sets
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+X_train, X_test, y_train, y_test, w_train, w_test = train_test_split(X, y, sample_weight, test_size=0.2, random_state=42)
 
 # Model Complexity Adjustment with GridSearchCV
 param_grid = {
@@ -106,9 +117,14 @@ param_grid = {
     'min_samples_leaf': [1, 2, 4]
 }
 
-rf = RandomForestRegressor(random_state=42)
-grid_search = GridSearchCV(estimator=rf, param_grid=param_grid, cv=3, n_jobs=-1, verbose=2, scoring='neg_mean_squared_error')
-grid_search.fit(X_train, y_train)
+# Route the sample weights to the forest and to the cross-validation scorer, so model selection
+# counts frames and not unique spectra
+sklearn.set_config(enable_metadata_routing=True)
+scoring = make_scorer(mean_squared_error, greater_is_better=False).set_score_request(sample_weight=True)
+
+rf = RandomForestRegressor(random_state=42).set_fit_request(sample_weight=True)
+grid_search = GridSearchCV(estimator=rf, param_grid=param_grid, cv=3, n_jobs=-1, verbose=2, scoring=scoring)
+grid_search.fit(X_train, y_train, sample_weight=w_train)
 
 # Best model after grid search
 best_rf = grid_search.best_estimator_
@@ -116,10 +132,10 @@ best_rf = grid_search.best_estimator_
 # Predictions
 y_pred = best_rf.predict(X_test)
 
-# Evaluation
-mse = mean_squared_error(y_test, y_pred)
-mae = mean_absolute_error(y_test, y_pred)
-r2 = r2_score(y_test, y_pred)
+# Evaluation (weighted, so it counts frames and not unique spectra)
+mse = mean_squared_error(y_test, y_pred, sample_weight=w_test)
+mae = mean_absolute_error(y_test, y_pred, sample_weight=w_test)
+r2 = r2_score(y_test, y_pred, sample_weight=w_test)
 
 print(f"Best Model Parameters: {grid_search.best_params_}")
 print(f"MSE: {mse}")
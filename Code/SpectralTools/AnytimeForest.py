@@ -0,0 +1,172 @@
+"""
+Anytime evaluation of the random forests with a confidence-based early exit.
+
+RandomForestRegressor/Classifier.predict always runs every tree, while for the
+rounded class outputs (Tubes, Maps, Datalogging) the answer is usually clear
+after a fraction of them. AnytimeForest evaluates the trees in chunks and stops
+for a frame as soon as:
+
+- regressor: the running mean +- z standard errors lies inside one rounding bin
+  (round(mean) +- 0.5), so rounding the full forest would very likely agree;
+- classifier: the vote margin between the two best classes can no longer be
+  overtaken by the remaining trees, or is at least `margin` of the trees used.
+
+Frames that are done drop out of the batch, so later chunks only run on the
+uncertain ones. predict() also returns how many trees every frame used.
+
+Usage (from this directory):
+    python AnytimeForest.py
+"""
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from ModelRegistry import ModelRegistry
+
+
+class AnytimeForest:
+    """Wraps a fitted forest (or a Pipeline ending in one) for early-exit prediction."""
+
+    def __init__(self, model, chunk_size=10, min_trees=10, z=3.0, margin=0.5):
+        if hasattr(model, 'steps'):
+            self.preprocess = model[:-1]
+            forest = model.steps[-1][1]
+        else:
+            self.preprocess = None
+            forest = model
+        self.forest = forest
+        self.estimators = forest.estimators_
+        self.is_classifier = hasattr(forest, 'classes_')
+        self.chunk_size = chunk_size
+        self.min_trees = min_trees
+        self.z = z
+        self.margin = margin
+
+    def _prepare(self, X):
+        if self.preprocess is not None:
+            X = self.preprocess.transform(X)
+        # The trees work in float32; converting once avoids a copy per tree
+        return np.ascontiguousarray(np.atleast_2d(X), dtype=np.float32)
+
+    def predict(self, X):
+        """Returns (predictions, trees_used) for every frame."""
+        X = self._prepare(X)
+        if self.is_classifier:
+            return self._predict_classifier(X)
+        return self._predict_regressor(X)
+
+    def _chunks(self):
+        for start in range(0, len(self.estimators), self.chunk_size):
+            yield self.estimators[start:start + self.chunk_size]
+
+    def _predict_regressor(self, X):
+        n = len(X)
+        sums = np.zeros(n)
+        squares = np.zeros(n)
+        used = np.zeros(n, dtype=np.int64)
+        active = np.arange(n)
+
+        for trees in self._chunks():
+            X_active = X[active]
+            predictions = np.column_stack([tree.predict(X_active, check_input=False) for tree in trees])
+            sums[active] += predictions.sum(axis=1)
+            squares[active] += np.square(predictions).sum(axis=1)
+            used[active] += len(trees)
+
+            k = used[active]
+            mean = sums[active] / k
+            variance = np.maximum(squares[active] / k - mean ** 2, 0.0) * k / np.maximum(k - 1, 1)
+            standard_error = np.sqrt(variance / k)
+            distance_to_edge = 0.5 - np.abs(mean - np.rint(mean))
+            done = (k >= self.min_trees) & (self.z * standard_error < distance_to_edge)
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+        return sums / used, used
+
+    def _predict_classifier(self, X):
+        n = len(X)
+        n_trees = len(self.estimators)
+        votes = np.zeros((n, len(self.forest.classes_)))
+        used = np.zeros(n, dtype=np.int64)
+        active = np.arange(n)
+
+        for trees in self._chunks():
+            X_active = X[active]
+            for tree in trees:
+                votes[active] += tree.predict_proba(X_active, check_input=False)
+            used[active] += len(trees)
+
+            k = used[active]
+            top_two = np.sort(votes[active], axis=1)[:, -2:] if votes.shape[1] > 1 else \
+                np.hstack([np.zeros((len(active), 1)), votes[active]])
+            lead = top_two[:, 1] - top_two[:, 0]
+            done = (k >= self.min_trees) & ((lead > n_trees - k) | (lead >= self.margin * k))
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+        return self.forest.classes_[np.argmax(votes, axis=1)], used
+
+
+def compare(name, model, X_test, y_test, rounded, settings, prepare=None):
+    """Prints rounded-class accuracy, trees used and latency for the full forest and anytime settings."""
+    X_model = prepare(X_test) if prepare else X_test
+
+    def score(y_pred):
+        if rounded:
+            return np.mean(np.rint(np.asarray(y_pred, dtype=float)) == np.asarray(y_test, dtype=float))
+        return np.mean(np.asarray(y_pred).astype(str) == np.asarray(y_test).astype(str))
+
+    def per_frame(predict):
+        # The serving loop predicts one frame at a time
+        start = time.perf_counter()
+        for row in X_model:
+            predict(row.reshape(1, -1))
+        return (time.perf_counter() - start) / len(X_model)
+
+    n_trees = len(AnytimeForest(model).estimators)
+    full = model.predict(X_model)
+    print(f"{name}:")
+    print(f"  Full forest:  accuracy {score(full):.4f}, {n_trees} trees, {per_frame(model.predict) * 1e3:.3f} ms/frame")
+    for label, options in settings:
+        anytime = AnytimeForest(model, **options)
+        y_pred, used = anytime.predict(X_model)
+        agreement = np.mean(np.rint(np.asarray(y_pred, dtype=float)) == np.rint(np.asarray(full, dtype=float))) \
+            if rounded else np.mean(y_pred == full)
+        print(f"  {label}: accuracy {score(y_pred):.4f}, agrees with full forest {agreement:.4f}, "
+              f"{used.mean():.1f} trees on average, "
+              f"{per_frame(lambda row: anytime.predict(row)) * 1e3:.3f} ms/frame")
+
+
+def main():
+    registry = ModelRegistry()
+    settings = [("Anytime z=2", {'z': 2.0}), ("Anytime z=3", {'z': 3.0}), ("Anytime z=4", {'z': 4.0})]
+
+    # Tubes5: same held-out split as Tubes5/Trainer.py
+    bundle = registry.get('tubes5-rf')
+    df = pd.read_csv(os.path.join(registry.root, 'ColorUsingTestTubes', 'Tubes5', 'data.csv'))
+    X = df.iloc[:, :-1].values
+    y = df.iloc[:, -1].values
+    _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    compare(f"tubes5-rf v{bundle.version}", bundle.model, X_test, y_test, rounded=True, settings=settings,
+            prepare=bundle.prepare)
+
+    # Datalogging: same held-out split as Datalogging/Trainer.py
+    bundle = registry.get('datalogging-rf')
+    directory = os.path.dirname(registry.metadata('datalogging-rf')['path'])
+    df = pd.read_csv(os.path.join(registry.root, directory, 'combined.csv'), header=None)
+    X = df.iloc[:, 1:].values
+    y = df.iloc[:, 0].values
+    _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    compare("datalogging-rf", bundle.model, X_test, y_test, rounded=False,
+            settings=[("Anytime margin=0.5", {'margin': 0.5}), ("Anytime margin=0.8", {'margin': 0.8})])
+
+
+if __name__ == "__main__":
+    main()
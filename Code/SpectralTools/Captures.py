@@ -0,0 +1,101 @@
+"""
+Helpers to read the labelled capture CSVs produced across the experiments.
+
+The captures do not share a single layout:
+- Datalogging/*.csv: header row, label in the first column ("0G1Y", ...)
+- Datalogging/combined.csv: no header, label in the first column
+- AdvancedInterface/combinedData.csv: header row, label ("DataTag") in the last column
+- AdvancedInterface/1.csv ... 5.csv: no header, no label (the file name is the label),
+  every line ends with a comma
+- Tubes*/data.csv and TestWith4Maps/data.csv: no header, numeric label in the last column
+
+load_capture() detects which one it is given and always returns the 18 channels
+as a float array together with the labels; read_capture() also returns the layout.
+"""
+
+import os
+import glob
+
+import numpy as np
+import pandas as pd
+
+N_CHANNELS = 18
+
+# Wavelengths of the 18 AS7265x channels, in the order the firmware prints them
+WAVELENGTHS = [410, 435, 460, 485, 510, 535, 560, 585, 610, 645, 680, 705, 730, 760, 810, 860, 900, 940]
+column_names = [f'{w}nm' for w in WAVELENGTHS]
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def read_capture(path, default_label=None):
+    """
+    Reads one capture CSV and returns (X, labels, layout).
+
+    layout describes the file so it can be written back the same way:
+    'header' is the header row (or None) and 'label_column' is 0, -1 or None
+    when the label comes from the file name.
+    """
+    df = pd.read_csv(path, header=None, dtype=str)
+
+    # The SwiftData captures end every line with a comma, which gives an empty last column
+    if df.shape[1] > N_CHANNELS and df.iloc[:, -1].isna().all():
+        df = df.iloc[:, :-1]
+
+    # Drop the header row if there is one (any cell that is not a number)
+    header = None
+    if not all(_is_number(v) for v in df.iloc[0, 1:-1]):
+        header = list(df.iloc[0])
+        df = df.iloc[1:]
+
+    if df.shape[1] == N_CHANNELS:
+        X = df.values.astype(float)
+        label = default_label if default_label is not None else os.path.splitext(os.path.basename(path))[0]
+        labels = np.full(len(X), label, dtype=object)
+        label_column = None
+    elif df.shape[1] == N_CHANNELS + 1:
+        # The label is whichever outer column is not numeric, the last one otherwise
+        if not all(_is_number(v) for v in df.iloc[:, 0]):
+            labels = df.iloc[:, 0].values.astype(object)
+            X = df.iloc[:, 1:].values.astype(float)
+            label_column = 0
+        else:
+            labels = df.iloc[:, -1].values.astype(object)
+            X = df.iloc[:, :-1].values.astype(float)
+            label_column = -1
+    else:
+        raise ValueError(f"{path}: expected {N_CHANNELS} or {N_CHANNELS + 1} columns, got {df.shape[1]}")
+
+    return X, labels, {'header': header, 'label_column': label_column}
+
+
+def load_capture(path, default_label=None):
+    """Reads one capture CSV and returns (X, labels) with X of shape (n, 18)."""
+    X, labels, _ = read_capture(path, default_label)
+    return X, labels
+
+
+def load_captures(paths):
+    """Reads several capture CSVs (or glob patterns) and stacks them."""
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(path)) or [path])
+
+    X_parts, label_parts = [], []
+    for file in files:
+        if os.path.getsize(file) == 0:
+            print(f"Skipping empty capture {file}")
+            continue
+        X, labels = load_capture(file)
+        X_parts.append(X)
+        label_parts.append(labels)
+
+    if not X_parts:
+        return np.empty((0, N_CHANNELS)), np.empty(0, dtype=object)
+    return np.vstack(X_parts), np.concatenate(label_parts)
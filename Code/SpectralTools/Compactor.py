@@ -0,0 +1,139 @@
+"""
+Training-set compaction: collapses repeated frames into unique rows with a sample weight.
+
+The captures contain long runs of identical or nearly identical frames (the
+sensor often reports the same values for several readings in a row). Every one
+of them is passed to training, so grid searches pay for the raw frame count
+instead of the number of distinct spectra.
+
+compact() quantises every channel to a grid of `tolerance` counts (exact
+duplicates only with tolerance 0), groups rows with the same label and the same
+quantised spectrum using np.unique, and returns one row per group (the group
+mean) with the group size as its sample_weight.
+
+The output keeps the layout of the input and adds a trailing sample_weight
+column. Datalogging/Trainer.py and Tubes5/Trainer.py pick up the compacted file
+when it is present and route the weights (sklearn metadata routing) to the
+models and to the cross-validation scorers, so model selection, like the final
+test metrics, counts frames rather than unique spectra.
+
+Usage (from this directory):
+    python Compactor.py ../ColorUsingTestTubes/Tubes5/data.csv --tolerance 1
+    python Compactor.py ../ColorUsingTestTubes/Tubes5/data.csv --tolerance 1 --compare
+"""
+
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score, make_scorer
+from sklearn.model_selection import train_test_split, GridSearchCV
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from Captures import read_capture
+
+
+def compact(X, y, tolerance=0.0, sample_weight=None):
+    """Returns (X_unique, y_unique, weights) with rows within `tolerance` of each other merged."""
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y)
+    weights = np.ones(len(X)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+
+    keys = np.rint(X / tolerance) if tolerance > 0 else X.copy()
+    _, label_codes = np.unique(y.astype(str), return_inverse=True)
+    keys = np.column_stack([label_codes, keys])
+    _, first, groups = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+
+    # Keep the groups in order of first appearance, so the output follows the capture
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    groups = rank[groups]
+    first = first[order]
+
+    totals = np.bincount(groups, weights=weights, minlength=len(first))
+    sums = np.zeros((len(first), X.shape[1]))
+    np.add.at(sums, groups, X * weights[:, None])
+    return sums / totals[:, None], y[first], totals
+
+
+def compact_file(path, output_path=None, tolerance=0.0):
+    """Compacts a capture CSV, keeping its layout and adding a sample_weight column."""
+    X, y, layout = read_capture(path)
+    X_unique, y_unique, weights = compact(X, y, tolerance)
+
+    values = pd.DataFrame(np.round(X_unique, 2))
+    labels = pd.Series(y_unique)
+    if layout['label_column'] is None:
+        columns = [values]
+    else:
+        columns = [labels, values] if layout['label_column'] == 0 else [values, labels]
+    out = pd.concat(columns + [pd.Series(weights.astype(int))], axis=1)
+
+    if output_path is None:
+        base, extension = os.path.splitext(path)
+        output_path = f'{base}_compacted{extension}'
+    header = layout['header']
+    out.to_csv(output_path, index=False, header=(header + ['sample_weight']) if header else False)
+    return output_path, len(X), len(X_unique)
+
+
+def compare(path, tolerance):
+    """Grid searches on raw vs compacted training frames and scores both on the same raw test frames."""
+    X, y, _ = read_capture(path)
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_compact, y_compact, weights = compact(X_train, y_train, tolerance)
+
+    # The Datalogging/Trainer.py models; StandardScaler ignores the weights, the classifiers and the
+    # cross-validation scorer use them
+    models_params = [
+        (RandomForestClassifier(random_state=42),
+         {'clf__n_estimators': [100, 200], 'clf__max_depth': [None, 10, 20], 'clf__min_samples_split': [2, 5]}),
+        (SVC(), {'clf__C': [0.1, 1, 10, 100], 'clf__kernel': ['linear', 'rbf']}),
+    ]
+    for model, params in models_params:
+        print(f"{type(model).__name__}:")
+        for name, (X_fit, y_fit, w_fit) in [("Raw frames", (X_train, y_train, None)),
+                                            ("Compacted", (X_compact, y_compact, weights))]:
+            with sklearn.config_context(enable_metadata_routing=True):
+                pipeline = Pipeline([('scaler', StandardScaler().set_fit_request(sample_weight=False)),
+                                     ('clf', clone(model).set_fit_request(sample_weight=True))])
+                scoring = make_scorer(accuracy_score).set_score_request(sample_weight=True)
+                grid_search = GridSearchCV(pipeline, params, cv=3, scoring=scoring)
+                start = time.perf_counter()
+                grid_search.fit(X_fit, y_fit, sample_weight=w_fit)
+                elapsed = time.perf_counter() - start
+            accuracy = np.mean(grid_search.predict(X_test) == y_test)
+            print(f"  {name}: {len(X_fit)} training rows, grid search {elapsed:.1f} s, "
+                  f"accuracy on {len(X_test)} raw test frames {accuracy:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv')
+    parser.add_argument('-o', '--output')
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='Quantisation step in sensor counts; 0 only merges exact duplicates')
+    parser.add_argument('--compare', action='store_true',
+                        help='Compare grid search time and accuracy on raw and compacted frames')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.csv, args.tolerance)
+        return
+
+    output_path, n_raw, n_unique = compact_file(args.csv, args.output, args.tolerance)
+    print(f"{n_raw} frames compacted into {n_unique} unique rows ({n_raw / n_unique:.1f}x), written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
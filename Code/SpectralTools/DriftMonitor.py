@@ -0,0 +1,245 @@
+"""
+Streaming per-channel statistics and drift alerts for the serving loop.
+
+For every sensor the monitor keeps, per channel and in O(1) memory:
+- a Welford/Chan running mean and variance,
+- a fixed-bin histogram sketch (uniform bins in log1p space) for quantiles,
+- the fraction of frames outside the range seen in training.
+
+All of it is exponentially decayed with a half-life in frames, so it describes
+the recent frames, and every update is a handful of numpy operations on the
+whole batch.
+
+The statistics are compared with a reference computed from the training data
+and saved next to the model (the registry entry points to it through
+"drift_reference"). Because the training data mixes all classes, a single
+class being measured moves the mean a lot; the alert therefore fires when too
+many recent frames fall outside the training range of a channel (LEDs
+ageing, dirty optics), while the mean and median shifts are reported for
+information.
+
+Usage (from this directory):
+    python DriftMonitor.py reference tubes5-rf ../ColorUsingTestTubes/Tubes5/data.csv
+    python DriftMonitor.py demo tubes5-rf ../ColorUsingTestTubes/Tubes5/data.csv
+"""
+
+import os
+import time
+import argparse
+
+import joblib
+import numpy as np
+from termcolor import colored
+
+from Captures import load_capture, WAVELENGTHS
+from ModelRegistry import ModelRegistry
+
+N_BINS = 256
+
+
+def build_reference(X, low_quantile=0.005, high_quantile=0.995, n_bins=N_BINS):
+    """Summarises the training frames per channel for later comparison."""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    low, high = np.quantile(X, [low_quantile, high_quantile], axis=0)
+    lo = np.log1p(np.maximum(X.min(axis=0), 0))
+    hi = np.log1p(np.maximum(X.max(axis=0), 0))
+    # Leave room on both sides so drifted values still land in a real bin
+    span = np.maximum(hi - lo, 1e-6)
+    lo, hi = lo - span / 2, hi + span / 2
+    reference = {
+        'n_frames': len(X),
+        'mean': X.mean(axis=0),
+        'std': X.std(axis=0),
+        'low': low,
+        'high': high,
+        'median': np.median(X, axis=0),
+        'bin_lo': lo,
+        'bin_width': (hi - lo) / n_bins,
+        'n_bins': n_bins,
+        'expected_outside': low_quantile + 1 - high_quantile,
+    }
+    return reference
+
+
+class ChannelStats:
+    """Exponentially decayed mean/variance, histogram and out-of-range fraction for all channels."""
+
+    def __init__(self, reference, halflife=500):
+        self.reference = reference
+        self.halflife = halflife
+        n_channels = len(reference['mean'])
+        self.weight = 0.0
+        self.mean = np.zeros(n_channels)
+        self.m2 = np.zeros(n_channels)
+        self.outside = np.zeros(n_channels)
+        self.hist = np.zeros((n_channels, reference['n_bins']))
+        self.frames = 0
+
+    def update(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        n = len(X)
+        if n == 0:
+            return
+        self.frames += n
+
+        # Decay the old statistics by the age of this batch
+        if self.halflife:
+            factor = 0.5 ** (n / self.halflife)
+            self.weight *= factor
+            self.m2 *= factor
+            self.outside *= factor
+            self.hist *= factor
+
+        # Chan et al. merge of the batch mean/variance into the running ones
+        batch_mean = X.mean(axis=0)
+        batch_m2 = np.square(X - batch_mean).sum(axis=0)
+        total = self.weight + n
+        delta = batch_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + np.square(delta) * self.weight * n / total
+        self.weight = total
+
+        reference = self.reference
+        self.outside += np.sum((X < reference['low']) | (X > reference['high']), axis=0)
+
+        bins = np.floor((np.log1p(np.maximum(X, 0)) - reference['bin_lo']) / reference['bin_width']).astype(np.int64)
+        bins = np.clip(bins, 0, reference['n_bins'] - 1)
+        n_channels = X.shape[1]
+        flat = (np.arange(n_channels) * reference['n_bins'] + bins).ravel()
+        self.hist += np.bincount(flat, minlength=n_channels * reference['n_bins']).reshape(n_channels, -1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.weight, 1e-12))
+
+    def quantile(self, q):
+        """Approximate per-channel quantile from the histogram sketch."""
+        cdf = np.cumsum(self.hist, axis=1)
+        cdf /= np.maximum(cdf[:, -1:], 1e-12)
+        bins = np.argmax(cdf >= q, axis=1)
+        centers = self.reference['bin_lo'] + (bins + 0.5) * self.reference['bin_width']
+        return np.expm1(centers)
+
+    def outside_fraction(self):
+        return self.outside / max(self.weight, 1e-12)
+
+
+class DriftMonitor:
+    """Per-sensor streaming statistics compared with the training reference."""
+
+    def __init__(self, reference, halflife=500, max_outside=0.1, min_frames=100):
+        self.reference = reference
+        self.halflife = halflife
+        self.max_outside = max_outside
+        self.min_frames = min_frames
+        self.sensors = {}
+        self._alerting = {}
+
+    @classmethod
+    def for_model(cls, registry, name, **options):
+        """Monitor using the reference saved with a registry model."""
+        path = registry.metadata(name).get('drift_reference')
+        if path is None:
+            raise KeyError(f"Model {name!r} has no drift reference; run 'DriftMonitor.py reference' first")
+        return cls(joblib.load(registry.resolve(path)), **options)
+
+    def update(self, X, sensor=0):
+        """Adds a batch of frames; returns the channels that just started drifting."""
+        stats = self.sensors.get(sensor)
+        if stats is None:
+            stats = self.sensors[sensor] = ChannelStats(self.reference, self.halflife)
+            self._alerting[sensor] = np.zeros(len(self.reference['mean']), dtype=bool)
+        stats.update(X)
+        if stats.frames < self.min_frames:
+            return []
+        drifting = stats.outside_fraction() > self.max_outside
+        new = drifting & ~self._alerting[sensor]
+        self._alerting[sensor] = drifting
+        return list(np.flatnonzero(new))
+
+    def status(self, sensor=0):
+        """Per-channel summary of the recent statistics against the reference."""
+        stats = self.sensors[sensor]
+        reference = self.reference
+        return {
+            'mean_shift': (stats.mean - reference['mean']) / np.maximum(reference['std'], 1e-12),
+            'std_ratio': stats.std / np.maximum(reference['std'], 1e-12),
+            'median_shift': (stats.quantile(0.5) - reference['median']) / np.maximum(reference['std'], 1e-12),
+            'outside_fraction': stats.outside_fraction(),
+            'drifting': self._alerting[sensor].copy(),
+        }
+
+
+def print_alerts(channels, sensor=0, status=None):
+    for channel in channels:
+        detail = f", {status['outside_fraction'][channel]:.0%} of recent frames outside training range" \
+            if status else ''
+        print(colored(f"  Drift on sensor {sensor}, channel {channel + 1} ({WAVELENGTHS[channel]}nm){detail}", 'red'))
+
+
+def save_reference(registry, name, captures):
+    """Builds the reference from the training captures and stores it with the latest model version."""
+    metadata = registry.metadata(name)
+    X = np.vstack([load_capture(path)[0] for path in captures])
+    reference = build_reference(X)
+    model_path = registry.resolve(metadata['path'])
+    path = os.path.join(os.path.dirname(model_path), f"{name}_v{metadata['version']}.drift.joblib")
+    joblib.dump(reference, path)
+    registry.update_metadata(name, metadata['version'], drift_reference=os.path.relpath(path, registry.root))
+    return path
+
+
+def demo(registry, name, captures):
+    """Replays the captures, then the same frames with the blue LEDs fading, and times the updates."""
+    monitor = DriftMonitor.for_model(registry, name)
+    X = np.vstack([load_capture(path)[0] for path in captures])
+
+    # Slowly fading short-wavelength channels, as with an ageing LED or dirty optics
+    fade = np.ones(X.shape[1])
+    fade[:4] = 0.6
+    ramp = np.linspace(0, 1, len(X))[:, None]
+    drifted = X * (1 - ramp * (1 - fade))
+
+    for label, frames in [("Original frames", X), ("Fading LEDs", drifted)]:
+        print(f"{label}:")
+        for start in range(0, len(frames), 50):
+            batch = frames[start:start + 50]
+            new = monitor.update(batch)
+            if new:
+                print(f"  After {start + len(batch)} frames:")
+                print_alerts(new, status=monitor.status())
+        status = monitor.status()
+        print(f"  Channels drifting at the end: {[int(c) + 1 for c in np.flatnonzero(status['drifting'])]}")
+
+    # Cost of one update compared with a model prediction on the same batch
+    bundle = registry.get(name)
+    batch = X[:50]
+    for label, call in [("Monitor update", lambda: monitor.update(batch)),
+                        ("Model predict", lambda: bundle.predict(batch))]:
+        start = time.perf_counter()
+        for _ in range(20):
+            call()
+        elapsed = (time.perf_counter() - start) / 20
+        print(f"{label}: {elapsed * 1e6 / len(batch):.2f} us/frame")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, text in [('reference', 'Save the training reference for a registry model'),
+                          ('demo', 'Replay captures with simulated drift')]:
+        subparser = subparsers.add_parser(command, help=text)
+        subparser.add_argument('name')
+        subparser.add_argument('captures', nargs='+')
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == 'reference':
+        path = save_reference(registry, args.name, args.captures)
+        print(f"Reference for {args.name} saved to {path}")
+    elif args.command == 'demo':
+        demo(registry, args.name, args.captures)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Decoder for the compact binary spectrum frames, with a fallback to the CSV text lines.
+
+LogReadings.ino prints every frame as 18 comma separated floats, which is about
+130 ASCII bytes per frame. The binary frame carries the same data in 79 bytes
+(float32) or 43 bytes (uint16 raw counts), all little endian:
+
+    offset  size  field
+    0       2     sync word 0xA5 0x5A
+    2       1     format: 0 = 18 x float32, 1 = 18 x uint16
+    3       2     sequence number (uint16, wraps around)
+    5       72/36 the 18 channel values, in the order of the text format
+    77/41   2     CRC-16/CCITT-FALSE over bytes 2 up to the CRC
+
+Large buffers (a backlog of frames, a recorded dump) are decoded at once: the
+sync words are located with numpy, the candidate frames are gathered into a 2D
+byte array, checked with a vectorised CRC and viewed as a structured array. The
+fixed cost of those numpy passes only pays off from a few hundred frames per
+buffer, so smaller buffers, including the reads of a live port (one or two
+frames), are decoded frame by frame with bytes.find and struct instead. Gaps in the sequence numbers are
+counted as dropped frames (this includes the corrupt ones), candidates with a
+bad CRC as corrupt frames. When the stream contains no sync words (the current
+firmware), complete text lines are parsed instead, so the same reader works
+with both.
+
+Usage (from this directory):
+    python FrameDecoder.py COM7          # decode a live board
+    python FrameDecoder.py --simulate    # decode a simulated device over a pty
+"""
+
+import os
+import sys
+import time
+import struct
+import binascii
+import threading
+
+import numpy as np
+import serial
+
+from Captures import N_CHANNELS
+
+SYNC = b'\xa5\x5a'
+FORMAT_FLOAT32 = 0
+FORMAT_UINT16 = 1
+
+HEADER_SIZE = 5
+CRC_SIZE = 2
+VALUE_DTYPES = {FORMAT_FLOAT32: np.dtype('<f4'), FORMAT_UINT16: np.dtype('<u2')}
+FRAME_DTYPES = {
+    fmt: np.dtype([('sync', '<u2'), ('format', 'u1'), ('seq', '<u2'),
+                   ('values', value_dtype, (N_CHANNELS,)), ('crc', '<u2')])
+    for fmt, value_dtype in VALUE_DTYPES.items()
+}
+FRAME_SIZES = {fmt: dtype.itemsize for fmt, dtype in FRAME_DTYPES.items()}
+MAX_FRAME_SIZE = max(FRAME_SIZES.values())
+MAX_LINE_LENGTH = 512
+# Buffers shorter than this are decoded frame by frame, longer ones in one vectorised pass
+SMALL_BUFFER = 256 * MAX_FRAME_SIZE
+
+
+def _crc_table():
+    table = np.zeros(256, dtype=np.uint32)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+# Below this many frames a plain loop over the bytes beats one numpy pass per byte position
+SCALAR_CRC_ROWS = 32
+
+
+def crc16_bytes(data):
+    """CRC-16/CCITT-FALSE of one bytes object."""
+    # crc_hqx is the same polynomial (0x1021, no reflection); starting from 0xFFFF makes it CCITT-FALSE
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def crc16(rows):
+    """CRC-16/CCITT-FALSE of every row of a 2D uint8 array (one CRC per row)."""
+    rows = np.atleast_2d(rows)
+    if rows.shape[0] < SCALAR_CRC_ROWS:
+        # A serial read usually holds only a few frames
+        return np.array([crc16_bytes(row.tobytes()) for row in rows], dtype=np.uint32)
+    crc = np.full(rows.shape[0], 0xFFFF, dtype=np.uint32)
+    # Vectorised over the frames, so the loop only runs once per byte position
+    for column in rows.T:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ column) & 0xFF]
+    return crc
+
+
+def encode_frames(values, seq_start=0, fmt=FORMAT_FLOAT32):
+    """Encodes an (n, 18) array into binary frames, as the firmware would send them."""
+    values = np.atleast_2d(values)
+    frames = np.zeros(len(values), dtype=FRAME_DTYPES[fmt])
+    frames['sync'] = np.frombuffer(SYNC, dtype='<u2')[0]
+    frames['format'] = fmt
+    frames['seq'] = (seq_start + np.arange(len(values))) % 65536
+    frames['values'] = values
+    raw = frames.view(np.uint8).reshape(len(values), -1)
+    frames['crc'] = crc16(raw[:, len(SYNC):-CRC_SIZE])
+    return frames.tobytes()
+
+
+def encode_text(values):
+    """Encodes an (n, 18) array the way LogReadings.ino prints it."""
+    return b''.join((','.join(f'{v:.2f}' for v in row) + '\r\n').encode() for row in np.atleast_2d(values))
+
+
+class FrameDecoder:
+    """Incremental decoder: feed() raw serial bytes, get back (seq, values) arrays."""
+
+    def __init__(self):
+        self._buffer = b''
+        self.mode = None  # 'binary' or 'text', detected from the stream
+        self._last_seq = None
+        self._text_seq = 0
+        self.frames = 0
+        self.dropped = 0
+        self.corrupt = 0
+
+    def feed(self, data):
+        """Decodes every complete frame in the buffered data plus `data`."""
+        self._buffer += data
+        if self.mode != 'binary' and SYNC in self._buffer:
+            self.mode = 'binary'
+        if self.mode == 'binary':
+            if len(self._buffer) < SMALL_BUFFER:
+                seq, values = self._decode_binary_small()
+            else:
+                seq, values = self._decode_binary()
+        else:
+            if self.mode is None and b'\n' in self._buffer:
+                self.mode = 'text'
+            seq, values = self._decode_text()
+        self.frames += len(seq)
+        return seq, values
+
+    def _decode_binary_small(self):
+        # Frame by frame with bytes.find and struct; same results as _decode_binary
+        buffer = self._buffer
+        n = len(buffer)
+        position = 0
+        last_end = 0
+        remainder = None
+        seq, values = [], []
+        while True:
+            start = buffer.find(SYNC, position)
+            if start < 0:
+                break
+            if start + HEADER_SIZE > n:
+                remainder = buffer[start:]
+                break
+            fmt = buffer[start + 2]
+            size = FRAME_SIZES.get(fmt, MAX_FRAME_SIZE)
+            if start + size > n:
+                # Everything from the first frame that is still being received is kept for the next call
+                remainder = buffer[start:]
+                break
+            if fmt in FRAME_SIZES and \
+                    crc16_bytes(buffer[start + len(SYNC):start + size - CRC_SIZE]) == \
+                    struct.unpack_from('<H', buffer, start + size - CRC_SIZE)[0]:
+                frame_seq = struct.unpack_from('<H', buffer, start + 3)[0]
+                if self._last_seq is not None:
+                    self.dropped += (frame_seq - self._last_seq - 1) % 65536
+                self._last_seq = frame_seq
+                seq.append(frame_seq)
+                values.append(np.frombuffer(buffer, VALUE_DTYPES[fmt], N_CHANNELS, start + HEADER_SIZE))
+                position = last_end = start + size
+            else:
+                self.corrupt += 1
+                position = start + 1
+
+        if remainder is None:
+            # Only a trailing half sync word outside the last frame can still become a frame
+            remainder = SYNC[:1] if buffer.endswith(SYNC[:1]) and last_end < n else b''
+        self._buffer = remainder
+        return np.array(seq, dtype=np.int64), np.array(values, dtype=np.float64).reshape(-1, N_CHANNELS)
+
+    def _decode_binary(self):
+        buffer = np.frombuffer(self._buffer, dtype=np.uint8)
+        n = len(buffer)
+        starts = np.flatnonzero((buffer[:-1] == SYNC[0]) & (buffer[1:] == SYNC[1]))
+
+        formats = np.full(len(starts), 255, dtype=np.uint8)
+        has_format = starts + HEADER_SIZE <= n
+        formats[has_format] = buffer[starts[has_format] + 2]
+        sizes = np.full(len(starts), MAX_FRAME_SIZE, dtype=np.int64)
+        for fmt, size in FRAME_SIZES.items():
+            sizes[formats == fmt] = size
+        complete = starts + sizes <= n
+
+        frame_starts, frame_sizes, seq, values = [], [], [], []
+        for fmt, size in FRAME_SIZES.items():
+            candidates = starts[complete & (formats == fmt)]
+            if len(candidates) == 0:
+                continue
+            raw = buffer[candidates[:, None] + np.arange(size)]
+            frames = raw.view(FRAME_DTYPES[fmt]).reshape(-1)
+            valid = crc16(raw[:, len(SYNC):-CRC_SIZE]) == frames['crc']
+            frame_starts.append(candidates[valid])
+            frame_sizes.append(np.full(valid.sum(), size))
+            seq.append(frames['seq'][valid].astype(np.int64))
+            values.append(frames['values'][valid].astype(np.float64))
+
+        frame_starts = np.concatenate(frame_starts or [np.empty(0, dtype=np.int64)])
+        order = np.argsort(frame_starts, kind='stable')
+        frame_starts = frame_starts[order]
+        frame_ends = frame_starts + np.concatenate(frame_sizes or [np.empty(0, dtype=np.int64)])[order]
+        seq = np.concatenate(seq or [np.empty(0, dtype=np.int64)])[order]
+        values = np.concatenate(values or [np.empty((0, N_CHANNELS))])[order]
+
+        # A sync word inside a payload could in theory pass the CRC; keep the first of overlapping frames
+        keep = np.ones(len(frame_starts), dtype=bool)
+        for i in np.flatnonzero(frame_starts[1:] < frame_ends[:-1]) + 1:
+            previous = np.flatnonzero(keep[:i])
+            if len(previous) and frame_starts[i] < frame_ends[previous[-1]]:
+                keep[i] = False
+        frame_starts, frame_ends, seq, values = frame_starts[keep], frame_ends[keep], seq[keep], values[keep]
+
+        # Sync words inside a good frame are payload bytes, not frames
+        slot = np.searchsorted(frame_starts, starts, side='right') - 1
+        inside = (slot >= 0) & (starts < frame_ends[np.maximum(slot, 0)]) if len(frame_starts) else \
+            np.zeros(len(starts), dtype=bool)
+
+        # Everything from the first frame that is still being received is kept for the next call
+        incomplete = np.flatnonzero(~complete & ~inside)
+        end = starts[incomplete[0]] if len(incomplete) else n
+        before_end = frame_starts < end
+        frame_starts, frame_ends, seq, values = \
+            frame_starts[before_end], frame_ends[before_end], seq[before_end], values[before_end]
+
+        # The other sync words that did not give a good frame are corrupt frames
+        self.corrupt += int(np.sum(~inside & (starts < end)))
+
+        self._count_dropped(seq)
+        remainder = self._buffer[end:]
+        if end == n:
+            # Only a trailing half sync word outside the last frame can still become a frame
+            last_end = frame_ends[-1] if len(frame_ends) else 0
+            remainder = SYNC[:1] if self._buffer.endswith(SYNC[:1]) and last_end < n else b''
+        self._buffer = remainder
+        return seq, values
+
+    def _count_dropped(self, seq):
+        if len(seq) == 0:
+            return
+        seq = seq.astype(np.int64)
+        if self._last_seq is not None:
+            seq_with_previous = np.concatenate([[self._last_seq], seq])
+        else:
+            seq_with_previous = seq
+        gaps = (np.diff(seq_with_previous) - 1) % 65536
+        self.dropped += int(gaps.sum())
+        self._last_seq = int(seq[-1])
+
+    def _decode_text(self):
+        if b'\n' not in self._buffer:
+            if len(self._buffer) > MAX_LINE_LENGTH:
+                self._buffer = self._buffer[-len(SYNC):]
+            return np.empty(0, dtype=np.int64), np.empty((0, N_CHANNELS))
+        complete, _, self._buffer = self._buffer.rpartition(b'\n')
+        rows = []
+        for line in complete.split(b'\n'):
+            fields = line.strip().split(b',')
+            if len(fields) != N_CHANNELS:
+                # Banners such as "AS7265x Spectral Triad Example" are not counted as corrupt
+                if len(fields) > 1:
+                    self.corrupt += 1
+                continue
+            try:
+                rows.append([float(field) for field in fields])
+            except ValueError:
+                self.corrupt += 1
+        values = np.array(rows, dtype=np.float64).reshape(-1, N_CHANNELS)
+        seq = self._text_seq + np.arange(len(values))
+        self._text_seq += len(values)
+        return seq, values
+
+
+def read_frames(ser, decoder=None, chunk_size=4096):
+    """Generator yielding (seq, values) batches from an open serial port."""
+    decoder = decoder or FrameDecoder()
+    while True:
+        data = ser.read(max(1, min(ser.in_waiting, chunk_size)))
+        if not data:
+            continue
+        seq, values = decoder.feed(data)
+        if len(seq):
+            yield seq, values
+
+
+def simulate_device(values, fmt=FORMAT_FLOAT32, text=False, drop=(), corrupt=(), chunk_size=64, delay=0.0,
+                    startup_delay=0.5):
+    """
+    Opens a pty that behaves like a board sending `values`; returns (port name, master fd).
+
+    Frame indices in `drop` are never sent and those in `corrupt` get a flipped
+    payload byte. The data is written from a background thread in small chunks,
+    so frames are split across reads like on a real UART. Like a board that resets
+    when the port opens, nothing is sent during the first `startup_delay` seconds.
+    """
+    # Unix only, so imported here to keep the module usable with COM ports on Windows
+    import tty
+
+    master, slave = os.openpty()
+    tty.setraw(slave)
+
+    def write():
+        time.sleep(startup_delay)
+        output = [b'AS7265x Spectral Triad Example\r\n']
+        for i, row in enumerate(np.atleast_2d(values)):
+            if i in drop:
+                continue
+            frame = bytearray(encode_text(row) if text else encode_frames(row, seq_start=i, fmt=fmt))
+            if i in corrupt:
+                frame[len(frame) // 2] ^= 0xFF
+            output.append(bytes(frame))
+        stream = b''.join(output)
+        for start in range(0, len(stream), chunk_size):
+            os.write(master, stream[start:start + chunk_size])
+            if delay:
+                time.sleep(delay)
+
+    threading.Thread(target=write, daemon=True).start()
+    return os.ttyname(slave), master
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--simulate':
+        rng = np.random.default_rng(42)
+        values = rng.uniform(0, 4000, size=(2000, N_CHANNELS)).astype(np.float32)
+        for label, options in [("binary float32", {}), ("binary uint16", {'fmt': FORMAT_UINT16}),
+                               ("text", {'text': True})]:
+            expected = np.rint(values) if options.get('fmt') == FORMAT_UINT16 else values
+            port, master = simulate_device(expected, drop={10, 500, 501}, corrupt={20, 900}, **options)
+            decoder = FrameDecoder()
+            received = []
+            with serial.Serial(port, 115200, timeout=0.5) as ser:
+                deadline = time.time() + 10
+                while time.time() < deadline:
+                    data = ser.read(4096)
+                    if not data and decoder.frames:
+                        break
+                    seq, batch = decoder.feed(data)
+                    received.append(batch)
+            os.close(master)
+            received = np.vstack(received)
+            sent = np.delete(expected, sorted({10, 500, 501, 20, 900}), axis=0)
+            print(f"{label}: {decoder.frames} frames decoded in {decoder.mode} mode, "
+                  f"{decoder.dropped} dropped, {decoder.corrupt} corrupt, "
+                  f"values match: {np.allclose(received, sent, atol=0.006)}")
+
+        # Decoding speed on one large buffer, and with one frame per read as from a live port
+        for label, stream, frames in [("binary", encode_frames(values), [encode_frames(row) for row in values]),
+                                      ("text", encode_text(values), [encode_text(row) for row in values])]:
+            start = time.perf_counter()
+            FrameDecoder().feed(stream)
+            whole = time.perf_counter() - start
+            decoder = FrameDecoder()
+            start = time.perf_counter()
+            for frame in frames:
+                decoder.feed(frame)
+            single = time.perf_counter() - start
+            print(f"{label}: {len(stream) / len(values):.0f} bytes/frame, {whole / len(values) * 1e6:.2f} us/frame "
+                  f"in one buffer, {single / len(values) * 1e6:.2f} us/frame one frame per read")
+        return
+
+    port = sys.argv[1] if len(sys.argv) > 1 else 'COM7'
+    decoder = FrameDecoder()
+    try:
+        with serial.Serial(port, 115200, timeout=1) as ser:
+            print(f"Serial port {port} opened successfully.")
+            for seq, values in read_frames(ser, decoder):
+                for s, row in zip(seq, values):
+                    print(f"{s}: {','.join(f'{v:.2f}' for v in row)}")
+    except serial.SerialException as e:
+        print(f"Error opening serial port: {e}")
+    except KeyboardInterrupt:
+        print(f"Stopped. {decoder.frames} frames, {decoder.dropped} dropped, {decoder.corrupt} corrupt.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+"""
+Model registry: one index for all trained models, loaded lazily and swapped without pauses.
+
+The trained models live as loose files in the experiment folders ("Random Forest
+Regressor.pkl", best_*.joblib, model.joblib + scaler.joblib, ...). registry.json
+lists them under a name, with versions and the metadata needed to use them:
+
+    task        what the model predicts
+    features    the input layout, "raw18" for the 18 channels as sent by the board
+    engineered  extra features appended before predicting, e.g. the Tubes5
+                ["mean", "std", "min", "max", "range"]
+    scaler      optional separate scaler (AdvancedInterface)
+    metrics     evaluation results from the trainer
+    drift_reference  training distribution summary used by DriftMonitor.py
+
+Models are only loaded on first use and kept in a bounded LRU cache. The serving
+loop predicts through a ServingHandle; publishing a new version loads it into
+the handle's standby slot off the serving path and then swaps the two slots with
+a single reference assignment, so the loop never waits for a load.
+
+Usage (from this directory):
+    python ModelRegistry.py list
+    python ModelRegistry.py scan
+    python ModelRegistry.py publish tubes5-rf ../ColorUsingTestTubes/Tubes5/best_random_forest_regressor.pkl \\
+        --task "Tubes5 drop count regression" --engineered mean std min max range
+    python ModelRegistry.py demo
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+
+DEFAULT_MANIFEST = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'registry.json')
+MODEL_EXTENSIONS = ('.pkl', '.joblib')
+
+# Row-wise statistics appended by Tubes5/Trainer.py. Its pandas std (ddof=1) runs after the mean column has
+# been appended, which keeps the sum of squares and adds one to n, so it equals ddof=0 over the 18 channels
+# (and np.std in TrainerAndAnalyser.py)
+ENGINEERED_FEATURES = {
+    'mean': lambda X: X.mean(axis=1),
+    'std': lambda X: X.std(axis=1),
+    'min': lambda X: X.min(axis=1),
+    'max': lambda X: X.max(axis=1),
+    'range': lambda X: X.max(axis=1) - X.min(axis=1),
+}
+
+
+def engineer_features(X, names):
+    """Appends the named row statistics to the raw channels, in the given order."""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    if not names:
+        return X
+    return np.hstack([X] + [ENGINEERED_FEATURES[name](X)[:, None] for name in names])
+
+
+class ModelBundle:
+    """A loaded model together with its scaler and metadata."""
+
+    def __init__(self, name, metadata, model, scaler=None):
+        self.name = name
+        self.version = metadata['version']
+        self.metadata = metadata
+        self.model = model
+        self.scaler = scaler
+        self.engineered = metadata.get('engineered', [])
+
+    def prepare(self, X):
+        X = engineer_features(X, self.engineered)
+        if self.scaler is not None:
+            X = self.scaler.transform(X)
+        return X
+
+    def predict(self, X):
+        return self.model.predict(self.prepare(X))
+
+    def __repr__(self):
+        return f"ModelBundle({self.name!r}, version={self.version})"
+
+
+class ServingHandle:
+    """
+    What the serving loop predicts through.
+
+    Reading `active` never takes a lock: publishing only ever replaces the
+    reference, and the previous bundle stays in the standby slot for rollback.
+    """
+
+    def __init__(self, name, bundle):
+        self.name = name
+        self.active = bundle
+        self.standby = None
+
+    def predict(self, X):
+        return self.active.predict(X)
+
+    def _swap(self, bundle):
+        self.standby = bundle
+        self.active, self.standby = self.standby, self.active
+
+    def rollback(self):
+        """Swaps the previous version back in."""
+        if self.standby is not None:
+            self.active, self.standby = self.standby, self.active
+
+
+class ModelRegistry:
+    """Index of the trained models with lazy loading and an LRU of loaded ones."""
+
+    def __init__(self, manifest_path=DEFAULT_MANIFEST, capacity=4):
+        self.manifest_path = manifest_path
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._watcher = None
+        self._load_manifest()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        else:
+            manifest = {'root': '.', 'models': {}}
+        self.root = os.path.normpath(os.path.join(os.path.dirname(self.manifest_path), manifest.get('root', '.')))
+        self.models = manifest['models']
+        self._manifest_mtime = os.path.getmtime(self.manifest_path) if os.path.exists(self.manifest_path) else None
+
+    def _save_manifest(self):
+        manifest = {'root': os.path.relpath(self.root, os.path.dirname(self.manifest_path)), 'models': self.models}
+        # Written to a temporary file first, so readers never see a half-written manifest
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.write('\n')
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_mtime = os.path.getmtime(self.manifest_path)
+
+    def resolve(self, path):
+        """Absolute path of a path stored in the manifest."""
+        return path if os.path.isabs(path) else os.path.join(self.root, path)
+
+    def names(self):
+        return sorted(self.models)
+
+    def metadata(self, name, version=None):
+        """Metadata of a version (the latest by default)."""
+        if name not in self.models:
+            raise KeyError(f"No model named {name!r} in the registry")
+        versions = self.models[name]
+        if version is None:
+            return max(versions, key=lambda entry: entry['version'])
+        for entry in versions:
+            if entry['version'] == version:
+                return entry
+        raise KeyError(f"Model {name!r} has no version {version}")
+
+    def get(self, name, version=None):
+        """Returns the loaded bundle, loading it on first use."""
+        metadata = self.metadata(name, version)
+        key = (name, metadata['version'])
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        # Loading happens outside the lock so other models stay available meanwhile
+        return self._remember(key, self._load(name, metadata))
+
+    def _load(self, name, metadata):
+        model = joblib.load(self.resolve(metadata['path']))
+        scaler = joblib.load(self.resolve(metadata['scaler'])) if metadata.get('scaler') else None
+        return ModelBundle(name, metadata, model, scaler)
+
+    def _remember(self, key, bundle):
+        with self._lock:
+            bundle = self._cache.setdefault(key, bundle)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                # Handles keep their own reference, so evicting never affects serving
+                self._cache.popitem(last=False)
+        return bundle
+
+    def loaded(self):
+        with self._lock:
+            return list(self._cache)
+
+    def handle(self, name):
+        """A serving handle that follows the latest version of `name`."""
+        handle = ServingHandle(name, self.get(name))
+        self._handles.setdefault(name, []).append(handle)
+        return handle
+
+    def publish(self, name, path, **metadata):
+        """Registers a new version of `name` and swaps it into the serving handles."""
+        version = max((entry['version'] for entry in self.models.get(name, [])), default=0) + 1
+        entry = {'version': version, 'path': os.path.relpath(os.path.abspath(path), self.root),
+                 'features': 'raw18', 'engineered': [], 'metrics': {}}
+        entry.update(metadata)
+        # Loaded before the manifest is written, so a model that cannot be loaded never becomes the latest
+        bundle = self._load(name, entry)
+        versions = self.models.setdefault(name, [])
+        versions.append(entry)
+        try:
+            self._save_manifest()
+        except Exception:
+            versions.remove(entry)
+            if not versions:
+                del self.models[name]
+            raise
+        self._remember((name, version), bundle)
+        self.refresh(name)
+        return version
+
+    def update_metadata(self, name, version=None, **metadata):
+        """Adds or changes metadata of a registered version and saves the manifest."""
+        self.metadata(name, version).update(metadata)
+        self._save_manifest()
+
+    def refresh(self, name):
+        """Loads the latest version of `name` and swaps it into the handles that serve it."""
+        handles = self._handles.get(name, [])
+        if not handles:
+            return
+        bundle = self.get(name)
+        for handle in handles:
+            if handle.active is not bundle:
+                handle._swap(bundle)
+
+    def watch(self, interval=1.0):
+        """Starts a background thread that picks up versions published by other processes."""
+        def run():
+            reported = set()
+            while True:
+                time.sleep(interval)
+                try:
+                    self._poll(reported)
+                except Exception as e:
+                    # A bad manifest or model must not stop the watcher; the handles keep their versions
+                    message = repr(e)
+                    if message not in reported:
+                        reported.add(message)
+                        print(f"Model registry watcher: {message}, still serving the current versions",
+                              file=sys.stderr)
+
+        self._watcher = threading.Thread(target=run, name='ModelRegistryWatcher', daemon=True)
+        self._watcher.start()
+
+    def _poll(self, reported):
+        if os.path.exists(self.manifest_path) and os.path.getmtime(self.manifest_path) != self._manifest_mtime:
+            self._load_manifest()
+        # Compared with what the handles actually serve, so a version that failed to load is retried
+        # once a newer one is published, and a later publish is never missed
+        for name in list(self._handles):
+            if name not in self.models:
+                continue
+            latest = self.metadata(name)['version']
+            if (name, latest) in reported:
+                continue
+            if any(handle.active.version != latest for handle in self._handles[name]):
+                try:
+                    self.refresh(name)
+                except Exception as e:
+                    reported.add((name, latest))
+                    print(f"Model registry watcher: could not load {name} version {latest} ({e!r}), "
+                          f"still serving the current version", file=sys.stderr)
+
+    def scan(self):
+        """Lists model files under the root that are not in the registry yet."""
+        known = set()
+        for versions in self.models.values():
+            for entry in versions:
+                known.add(os.path.normpath(self.resolve(entry['path'])))
+                for key in ('scaler', 'drift_reference'):
+                    if entry.get(key):
+                        known.add(os.path.normpath(self.resolve(entry[key])))
+        found = []
+        for extension in MODEL_EXTENSIONS:
+            found.extend(glob.glob(os.path.join(self.root, '**', '*' + extension), recursive=True))
+        return sorted(os.path.relpath(path, self.root) for path in found if os.path.normpath(path) not in known)
+
+
+def demo(registry):
+    """
+    Serves the Tubes5 data through a handle while another registry publishes a new version.
+
+    Works on a temporary manifest holding only version 1 of tubes5-rf, so registry.json is left alone.
+    """
+    from Captures import load_capture
+
+    name = 'tubes5-rf'
+    first = dict(registry.metadata(name, 1))
+    second = dict(registry.metadata(name, 2))
+    X, _ = load_capture(os.path.join(registry.root, 'ColorUsingTestTubes', 'Tubes5', 'data.csv'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        manifest_path = os.path.join(directory, 'registry.json')
+        with open(manifest_path, 'w') as f:
+            json.dump({'root': registry.root, 'models': {name: [first]}}, f)
+
+        serving = ModelRegistry(manifest_path)
+        handle = serving.handle(name)
+        serving.watch(interval=0.05)
+
+        # Like a trainer in another process publishing a new version
+        def publish():
+            metadata = {key: value for key, value in second.items() if key not in ('version', 'path')}
+            ModelRegistry(manifest_path).publish(name, registry.resolve(second['path']), **metadata)
+
+        publisher = threading.Thread(target=publish)
+        latencies, versions = [], []
+        served = 0
+        published_at = None
+        deadline = time.perf_counter() + 30
+        i = 0
+        # Serve the data once, and keep going until the new version is in (or the deadline passes)
+        while i < len(X) or (handle.active.version == 1 and time.perf_counter() < deadline):
+            if i == len(X) // 2:
+                published_at = len(latencies)
+                publisher.start()
+            row = X[i % len(X)]
+            start = time.perf_counter()
+            prediction = handle.predict(row)
+            latencies.append(time.perf_counter() - start)
+            versions.append(handle.active.version)
+            served += len(prediction)
+            i += 1
+        publisher.join()
+
+    latencies = np.array(latencies) * 1e3
+    versions = np.array(versions)
+    swapped_at = int(np.argmax(versions == 2)) if np.any(versions == 2) else len(versions)
+    before = latencies[:published_at]
+    during = latencies[published_at:swapped_at + 1]
+    print(f"{len(latencies)} frames submitted, {served} predictions returned, "
+          f"{len(latencies) - served} skipped")
+    print(f"Version 1 served {np.sum(versions == 1)} frames, version 2 served {np.sum(versions == 2)}")
+    print(f"Latency before publishing: median {np.median(before):.2f} ms, p99 {np.percentile(before, 99):.2f} ms")
+    print(f"Latency while version 2 was loaded and swapped in ({len(during)} frames): "
+          f"median {np.median(during):.2f} ms, max {during.max():.2f} ms "
+          f"({during.max() / np.median(before):.1f}x the median before)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--manifest', default=DEFAULT_MANIFEST)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help='List the registered models')
+    subparsers.add_parser('scan', help='List model files that are not registered yet')
+
+    publish_parser = subparsers.add_parser('publish', help='Register a new version of a model')
+    publish_parser.add_argument('name')
+    publish_parser.add_argument('path')
+    publish_parser.add_argument('--scaler')
+    publish_parser.add_argument('--task', default='')
+    publish_parser.add_argument('--engineered', nargs='*', default=[], choices=sorted(ENGINEERED_FEATURES))
+    publish_parser.add_argument('--metric', nargs=2, action='append', default=[], metavar=('NAME', 'VALUE'))
+
+    subparsers.add_parser('demo', help='Hot swap a model while serving the Tubes5 data')
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.manifest)
+
+    if args.command == 'list':
+        for name in registry.names():
+            for entry in registry.models[name]:
+                engineered = f" + {', '.join(entry['engineered'])}" if entry.get('engineered') else ''
+                print(f"{name} v{entry['version']}: {entry.get('task', '')} [{entry.get('features', '')}{engineered}]")
+                print(f"    {entry['path']}")
+    elif args.command == 'scan':
+        for path in registry.scan():
+            print(path)
+    elif args.command == 'publish':
+        metadata = {'task': args.task, 'engineered': args.engineered,
+                    'metrics': {name: float(value) for name, value in args.metric}}
+        if args.scaler:
+            metadata['scaler'] = os.path.relpath(os.path.abspath(args.scaler), registry.root)
+        try:
+            version = registry.publish(args.name, args.path, **metadata)
+        except Exception as e:
+            print(f"Could not load {args.path} ({e!r}), nothing was published")
+            return
+        print(f"Published {args.name} version {version}")
+    elif args.command == 'demo':
+        demo(registry)
+
+
+if __name__ == "__main__":
+    main()
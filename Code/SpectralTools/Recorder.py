@@ -0,0 +1,323 @@
+"""
+Append-only binary recorder for the live serial stream.
+
+Instead of logging through Datalogging.pde into CSV files and merging those with
+Combiner.py or join.py afterwards, frames are appended straight from the serial
+stream to binary segment files, one fixed-size record per frame:
+
+    timestamp (float64, seconds since the epoch), seq (uint32), sensor (uint16),
+    label (16 bytes), values (18 x float32)
+
+A segment is rotated after `max_records` records. Next to every segment a sparse
+index holds the timestamp and position of every `index_interval`-th record, so a
+time range is found with two binary searches and read back as a memory-mapped
+view, without scanning the files.
+
+The serving loop only hands batches to a queue; a background thread does the
+writing. When the disk cannot keep up, batches are dropped (and counted) rather
+than slowing the loop down. If the writer fails (disk full, ...), the error is
+kept, later batches are dropped and stop() raises it.
+`ReplayProfiler.py run <capture> --record DIR` serves a capture while recording
+it and compares the predict latency with recording on and off.
+
+Usage (from this directory):
+    python Recorder.py record captures/ --label 2G1Y [--port COM7]
+    python Recorder.py export captures/ out.csv [--start T0] [--end T1]
+"""
+
+import os
+import sys
+import glob
+import time
+import queue
+import argparse
+import threading
+
+import numpy as np
+import serial
+
+from Captures import N_CHANNELS
+from FrameDecoder import FrameDecoder, read_frames, simulate_device
+
+MAGIC = b'SPECSEG1'
+LABEL_SIZE = 16
+
+RECORD_DTYPE = np.dtype([('timestamp', '<f8'), ('seq', '<u4'), ('sensor', '<u2'),
+                         ('label', f'S{LABEL_SIZE}'), ('values', '<f4', (N_CHANNELS,))])
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'), ('record', '<i8')])
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('n_channels', '<u2'), ('record_size', '<u2'), ('reserved', '<u4')])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+
+class CaptureRecorder:
+    """Records frames into rotating append-only segments from a background thread."""
+
+    def __init__(self, directory, label='', sensor=0, max_records=100_000, index_interval=256, queue_size=1024):
+        self.directory = directory
+        self.label = label
+        self.sensor = sensor
+        self.max_records = max_records
+        self.index_interval = index_interval
+        self.dropped = 0
+        self.written = 0
+        self.error = None  # set when the writer thread failed; nothing is recorded after that
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._data_file = None
+        self._index_file = None
+        self._last_timestamp = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='CaptureRecorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Writes everything still queued, closes the current segment and raises the writer's error if any."""
+        if self._thread is not None:
+            # A writer that died leaves a full queue behind, so never wait on it unconditionally
+            while self._thread.is_alive():
+                try:
+                    self._queue.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            self._thread.join()
+            self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.stop()
+        except Exception:
+            # Do not hide the exception that ended the with block
+            if exc_type is None:
+                raise
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+    def record(self, values, seq=None, label=None, sensor=None, timestamp=None):
+        """Queues a batch of frames; never blocks. Returns False if the batch was dropped."""
+        values = np.atleast_2d(values)
+        if values.ndim != 2 or values.shape[1] != N_CHANNELS:
+            raise ValueError(f"Expected frames with {N_CHANNELS} channels, got shape {values.shape}")
+        if seq is not None and np.ndim(seq) and len(seq) != len(values):
+            raise ValueError(f"Got {len(seq)} sequence numbers for {len(values)} frames")
+        if self.error is not None:
+            self.dropped += len(values)
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        item = (values, seq, self.label if label is None else label,
+                self.sensor if sensor is None else sensor, timestamp)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += len(values)
+            return False
+
+    def _records(self, values, seq, label, sensor, timestamp):
+        records = np.zeros(len(values), dtype=RECORD_DTYPE)
+        # Timestamps are kept non-decreasing so the index stays sorted
+        timestamps = np.maximum(np.broadcast_to(np.asarray(timestamp, dtype=float), (len(values),)),
+                                self._last_timestamp)
+        records['timestamp'] = np.maximum.accumulate(timestamps)
+        records['seq'] = np.arange(len(values)) if seq is None else seq
+        records['sensor'] = sensor
+        records['label'] = str(label).encode()[:LABEL_SIZE]
+        records['values'] = values
+        self._last_timestamp = records['timestamp'][-1]
+        return records
+
+    def _open_segment(self):
+        self._close_segment()
+        number = len(glob.glob(os.path.join(self.directory, 'segment_*.bin')))
+        base = os.path.join(self.directory, f'segment_{number:06d}')
+        while os.path.exists(base + '.bin'):
+            number += 1
+            base = os.path.join(self.directory, f'segment_{number:06d}')
+        self._data_file = open(base + '.bin', 'ab')
+        self._index_file = open(base + '.idx', 'ab')
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['n_channels'] = N_CHANNELS
+        header['record_size'] = RECORD_DTYPE.itemsize
+        self._data_file.write(header.tobytes())
+        self._segment_records = 0
+
+    def _close_segment(self):
+        for file in (self._data_file, self._index_file):
+            if file is not None:
+                file.close()
+        self._data_file = self._index_file = None
+
+    def _append(self, records):
+        while len(records):
+            if self._data_file is None or self._segment_records >= self.max_records:
+                self._open_segment()
+            chunk = records[:self.max_records - self._segment_records]
+            records = records[len(chunk):]
+
+            positions = self._segment_records + np.arange(len(chunk))
+            indexed = positions % self.index_interval == 0
+            self._data_file.write(chunk.tobytes())
+            self._data_file.flush()
+            if indexed.any():
+                entries = np.zeros(int(indexed.sum()), dtype=INDEX_DTYPE)
+                entries['timestamp'] = chunk['timestamp'][indexed]
+                entries['record'] = positions[indexed]
+                # The index is written after the data it points to, so readers never see dangling entries
+                self._index_file.write(entries.tobytes())
+                self._index_file.flush()
+            self._segment_records += len(chunk)
+            self.written += len(chunk)
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batches = [item]
+                # Write everything that piled up in one go
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._queue.put(None)
+                        break
+                    batches.append(item)
+                self._append(np.concatenate([self._records(*batch) for batch in batches]))
+        except Exception as e:
+            # Kept for stop() to raise; record() drops everything from now on
+            self.error = e
+            print(f"Recorder stopped after {self.written} frames: {e!r}", file=sys.stderr)
+        finally:
+            self._close_segment()
+
+
+class CaptureReader:
+    """Reads time ranges back from the recorded segments without scanning them."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'segment_*.bin')))
+
+    @staticmethod
+    def _open(path):
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header['magic'][0] != MAGIC:
+            raise ValueError(f"{path} is not a capture segment")
+        if header['record_size'][0] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path} was written with a different record layout")
+        # A record that is still being written is ignored
+        count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        if count == 0:
+            return np.empty(0, dtype=RECORD_DTYPE), np.empty(0, dtype=INDEX_DTYPE)
+        records = np.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=HEADER_SIZE, shape=(count,))
+        index_path = os.path.splitext(path)[0] + '.idx'
+        index = np.fromfile(index_path, dtype=INDEX_DTYPE) if os.path.exists(index_path) else \
+            np.empty(0, dtype=INDEX_DTYPE)
+        return records, index[index['record'] < count]
+
+    @staticmethod
+    def _locate(records, index, timestamp):
+        """Position of the first record at or after `timestamp`, using the sparse index."""
+        block = np.searchsorted(index['timestamp'], timestamp, side='left') - 1
+        lo = index['record'][block] if block >= 0 else 0
+        hi = index['record'][block + 1] + 1 if block + 1 < len(index) else len(records)
+        return lo + np.searchsorted(records['timestamp'][lo:hi], timestamp, side='left')
+
+    def read(self, start=None, end=None):
+        """Records with start <= timestamp < end, memory-mapped when they come from one segment."""
+        start = -np.inf if start is None else start
+        end = np.inf if end is None else end
+        parts = []
+        for path in self.segments():
+            records, index = self._open(path)
+            if len(records) == 0 or records['timestamp'][0] >= end or records['timestamp'][-1] < start:
+                continue
+            first = self._locate(records, index, start)
+            last = self._locate(records, index, end)
+            if last > first:
+                parts.append(records[first:last])
+        if not parts:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def export_csv(records, path):
+    """Writes records in the Datalogging CSV layout (Label,Wavelength1,...), ready for Trainer.py."""
+    header = 'Label,' + ','.join(f'Wavelength{i + 1}' for i in range(N_CHANNELS))
+    with open(path, 'w', newline='') as f:
+        f.write(header + '\n')
+        for label, row in zip(records['label'], records['values']):
+            f.write(label.decode() + ',' + ','.join(f'{v:.2f}' for v in row) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record the serial stream')
+    record_parser.add_argument('directory')
+    record_parser.add_argument('--label', default='')
+    record_parser.add_argument('--sensor', type=int, default=0)
+    record_parser.add_argument('--port', default='COM7')
+    record_parser.add_argument('--simulate', type=int, metavar='N_FRAMES',
+                               help='Record N frames from a simulated device instead of the port')
+
+    export_parser = subparsers.add_parser('export', help='Export a time range to CSV')
+    export_parser.add_argument('directory')
+    export_parser.add_argument('csv')
+    export_parser.add_argument('--start', type=float)
+    export_parser.add_argument('--end', type=float)
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        records = CaptureReader(args.directory).read(args.start, args.end)
+        export_csv(records, args.csv)
+        print(f"Exported {len(records)} frames to {args.csv}")
+        return
+
+    port = args.port
+    if args.simulate:
+        rng = np.random.default_rng(42)
+        port, _ = simulate_device(rng.uniform(0, 4000, size=(args.simulate, N_CHANNELS)))
+
+    decoder = FrameDecoder()
+    recorder = CaptureRecorder(args.directory, label=args.label, sensor=args.sensor)
+    start = time.perf_counter()
+    try:
+        with serial.Serial(port, 115200, timeout=1) as ser, recorder:
+            print(f"Recording {port} into {args.directory}...")
+            for seq, values in read_frames(ser, decoder):
+                recorder.record(values, seq=seq)
+                if args.simulate and decoder.frames >= args.simulate:
+                    break
+    except serial.SerialException as e:
+        print(f"Error opening serial port: {e}")
+    except OSError as e:
+        print(f"Recording failed: {e}")
+    except KeyboardInterrupt:
+        print("Recording stopped by user.")
+    elapsed = time.perf_counter() - start
+    print(f"{recorder.written} frames written, {recorder.dropped} dropped by the recorder, "
+          f"{decoder.dropped} lost on the line, in {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
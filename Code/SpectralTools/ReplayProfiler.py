@@ -0,0 +1,391 @@
+"""
+Deterministic replay profiler for the acquisition-to-prediction pipeline.
+
+Replays a recorded capture through the same steps as the serving loop in
+Tubes5/TrainerAndAnalyser.py, without a board on COM7:
+
+    parse     readline + decode + strip + np.fromstring (FrameDecoder.feed with --binary)
+    engineer  the features listed in the registry entry (ModelRegistry.engineer_features)
+    predict   model.predict on one frame
+    colour    rounding and the colour/termcolor mapping
+    output    the two print() calls, into a sink instead of the terminal
+
+With --record DIR the replay is timed a second time while every parsed frame is
+also handed to a Recorder.py CaptureRecorder, the way a serving loop would record
+next to predicting, and the predict latency with and without recording is
+reported.
+
+The input can be a capture CSV, a Recorder.py segment directory or a raw serial
+dump of the text firmware; CSV and recordings are turned into the bytes the
+firmware would send, as text lines or (--binary) as binary frames. Every
+run uses the same bytes, a warm-up and a fixed number of repeats, so two models
+or two code versions can be compared on identical input.
+
+Each run reports per-stage timings (mean, median, p99), per-stage allocations
+from tracemalloc, and either cProfile statistics or a sampling profile in the
+folded-stack format used by flamegraph.pl and speedscope.
+
+Usage (from this directory):
+    python ReplayProfiler.py run ../ColorUsingTestTubes/Tubes5/data.csv --model tubes5-rf --report v2.json
+    python ReplayProfiler.py run captures/ --model tubes5-rf --version 1 --report v1.json --folded v1.folded
+    python ReplayProfiler.py run ../ColorUsingTestTubes/Tubes5/data.csv --record captures/ --profiler none
+    python ReplayProfiler.py compare v1.json v2.json
+"""
+
+import io
+import os
+import gc
+import sys
+import json
+import time
+import pstats
+import cProfile
+import argparse
+import threading
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+from termcolor import colored
+
+from Captures import load_capture
+from FrameDecoder import FrameDecoder, encode_frames, encode_text
+from ModelRegistry import ModelRegistry, engineer_features
+from Recorder import CaptureReader, CaptureRecorder
+
+STAGES = ['parse', 'engineer', 'predict', 'colour', 'output']
+COLOR_MAP = {1: "orange", 2: "pink", 3: "purple", 4: "grey"}
+TERMCOLOR_NAMES = {'orange': 'light_red', 'pink': 'light_magenta', 'purple': 'magenta', 'grey': 'light_grey'}
+
+
+def load_stream(path, binary=False):
+    """The bytes the board would have sent (a list of frames with `binary`)."""
+    if os.path.isdir(path):
+        values = CaptureReader(path).read()['values'].astype(np.float64)
+    elif path.lower().endswith('.csv'):
+        values = load_capture(path)[0]
+    else:
+        if binary:
+            raise ValueError("--binary needs a capture CSV or a recording, raw dumps are replayed as text")
+        with open(path, 'rb') as f:
+            return f.read()
+    if binary:
+        # One bytes object per frame, so decoding is timed per frame like the text parse
+        return [encode_frames(row, seq_start=i) for i, row in enumerate(values)]
+    return encode_text(values)
+
+
+class ServingPipeline:
+    """The stages of TrainerAndAnalyser.process_and_predict, split so they can be timed."""
+
+    def __init__(self, bundle, sink, binary=False, recorder=None):
+        self.model = bundle.model
+        self.engineered = bundle.engineered
+        self.scaler = bundle.scaler
+        self.sink = sink
+        self.binary = binary
+        self.decoder = FrameDecoder()
+        self.recorder = recorder
+        self.stages = STAGES[:1] + ['record'] + STAGES[1:] if recorder is not None else STAGES
+
+    def frames(self, stream):
+        if self.binary:
+            return stream
+        # Like ser.readline() on the replayed bytes
+        return io.BytesIO(stream).readlines()
+
+    def parse(self, line):
+        if self.binary:
+            values = self.decoder.feed(line)[1]
+            return values[0] if len(values) else None
+        input_string = line.decode('utf-8').strip()
+        print(f"Received data: {input_string}", file=self.sink)
+        try:
+            data = np.fromstring(input_string, dtype=float, sep=',')
+        except ValueError as e:
+            print(f"Error converting input to array: {e}", file=self.sink)
+            return None
+        if data.shape[0] != 18:
+            print("Input data does not have 18 features.", file=self.sink)
+            return None
+        return data
+
+    def record(self, data):
+        # Only queues the frame; the recorder's thread writes it
+        self.recorder.record(data)
+        return data
+
+    def engineer(self, data):
+        return engineer_features(data, self.engineered)
+
+    def predict(self, data):
+        if self.scaler is not None:
+            data = self.scaler.transform(data)
+        return self.model.predict(data)
+
+    def colour(self, prediction):
+        rounded_value = round(prediction[0])
+        if rounded_value in COLOR_MAP:
+            color_name = COLOR_MAP[rounded_value]
+            color_text = colored(color_name, TERMCOLOR_NAMES[color_name])
+        else:
+            color_text = colored("Unknown", 'red')
+        return prediction, rounded_value, color_text
+
+    def output(self, result):
+        prediction, rounded_value, color_text = result
+        print(f"Predicted class for input data: {prediction[0]}", file=self.sink)
+        print(f"Predicted class for input data: {prediction[0]} | {rounded_value} | {color_text}", file=self.sink)
+
+
+def replay(pipeline, frames, timings=None, allocations=None):
+    """Runs every frame through the stages, optionally timing or tracing each stage."""
+    stage_functions = [getattr(pipeline, stage) for stage in pipeline.stages]
+    for i, frame in enumerate(frames):
+        value = frame
+        for s, function in enumerate(stage_functions):
+            if allocations is not None:
+                before = tracemalloc.take_snapshot() if i < allocations['snapshot_frames'] else None
+                tracemalloc.reset_peak()
+                current_before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter_ns()
+            value = function(value)
+            elapsed = time.perf_counter_ns() - start
+            if timings is not None:
+                timings[s, i] = elapsed
+            if allocations is not None:
+                allocations['peak'][s] += tracemalloc.get_traced_memory()[1] - current_before
+                if before is not None:
+                    diff = tracemalloc.take_snapshot().compare_to(before, 'filename')
+                    allocations['blocks'][s] += sum(max(stat.count_diff, 0) for stat in diff)
+                    allocations['bytes'][s] += sum(max(stat.size_diff, 0) for stat in diff)
+            if value is None:
+                break
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread at a fixed interval and keeps folded stacks."""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def timed_replay(pipeline, frames, repeats, no_gc=False):
+    """Replays the frames `repeats` times; returns the (repeats, stages, frames) timings in ns."""
+    timings = np.zeros((repeats, len(pipeline.stages), len(frames)), dtype=np.int64)
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    if no_gc:
+        gc.disable()
+    try:
+        for r in range(repeats):
+            if isinstance(pipeline.sink, io.StringIO):
+                pipeline.sink.seek(0)
+                pipeline.sink.truncate()
+            replay(pipeline, frames, timings[r])
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return timings
+
+
+def run(args):
+    registry = ModelRegistry()
+    bundle = registry.get(args.model, args.version)
+    stream = load_stream(args.input, binary=args.binary)
+    sink = sys.stdout if args.show_output else io.StringIO()
+    pipeline = ServingPipeline(bundle, sink, binary=args.binary)
+    frames = pipeline.frames(stream)
+    if args.frames:
+        frames = frames[:args.frames]
+
+    # Warm-up, so caches and lazy imports do not end up in the first repeat
+    replay(pipeline, frames[:args.warmup])
+    timings = timed_replay(pipeline, frames, args.repeats, args.no_gc)
+
+    # The same replay with every frame also going to a recorder
+    recording = None
+    if args.record:
+        recorder = CaptureRecorder(args.record, label=args.label)
+        with recorder:
+            recording_pipeline = ServingPipeline(bundle, sink, binary=args.binary, recorder=recorder)
+            recording_timings = timed_replay(recording_pipeline, frames, args.repeats, args.no_gc)
+        predict = STAGES.index('predict')
+        without = timings[:, predict].ravel() / 1e3
+        with_recording = recording_timings[:, recording_pipeline.stages.index('predict')].ravel() / 1e3
+        recording = {
+            'directory': os.path.abspath(args.record),
+            'written': recorder.written,
+            'dropped': recorder.dropped,
+            'record_us': float(np.median(recording_timings[:, recording_pipeline.stages.index('record')]) / 1e3),
+            'predict_median_us': {'off': float(np.median(without)), 'on': float(np.median(with_recording))},
+            'predict_p99_us': {'off': float(np.percentile(without, 99)),
+                               'on': float(np.percentile(with_recording, 99))},
+            'frame_median_us': {'off': float(np.median(timings.sum(axis=1)) / 1e3),
+                                'on': float(np.median(recording_timings.sum(axis=1)) / 1e3)},
+        }
+
+    # Allocations, in a separate pass so tracing does not distort the timings
+    allocations = {'snapshot_frames': min(args.alloc_frames, len(frames)),
+                   'peak': np.zeros(len(STAGES)), 'blocks': np.zeros(len(STAGES)), 'bytes': np.zeros(len(STAGES))}
+    tracemalloc.start()
+    replay(pipeline, frames, allocations=allocations)
+    top_sites = tracemalloc.take_snapshot().statistics('lineno')[:10]
+    tracemalloc.stop()
+
+    # Function-level profile, again as a separate pass
+    profile_text = None
+    if args.profiler == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.runcall(replay, pipeline, frames)
+        if args.pstats:
+            profiler.dump_stats(args.pstats)
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(args.top)
+        profile_text = text.getvalue()
+    elif args.profiler == 'sampling':
+        with SamplingProfiler(threading.get_ident(), interval=args.interval) as sampler:
+            replay(pipeline, frames)
+        if args.folded:
+            sampler.write_folded(args.folded)
+        profile_text = '\n'.join(f"{count:6d}  {stack.split(';')[-1]}"
+                                 for stack, count in sampler.stacks.most_common(args.top))
+
+    # Per repeat total, then the best repeat for the per-frame statistics
+    totals = timings.sum(axis=(1, 2))
+    best = timings[int(np.argmin(totals))]
+    n_frames = len(frames)
+    report = {
+        'input': os.path.abspath(args.input),
+        'model': args.model,
+        'version': bundle.version,
+        'binary': args.binary,
+        'frames': n_frames,
+        'repeats': args.repeats,
+        'total_ms': {'min': float(totals.min() / 1e6), 'median': float(np.median(totals) / 1e6)},
+        'recording': recording,
+        'stages': {
+            stage: {
+                'mean_us': float(best[s].mean() / 1e3),
+                'median_us': float(np.median(best[s]) / 1e3),
+                'p99_us': float(np.percentile(best[s], 99) / 1e3),
+                'share': float(best[s].sum() / max(best.sum(), 1)),
+                'alloc_blocks_per_frame': float(allocations['blocks'][s] / max(allocations['snapshot_frames'], 1)),
+                'alloc_bytes_per_frame': float(allocations['bytes'][s] / max(allocations['snapshot_frames'], 1)),
+                'peak_bytes_per_frame': float(allocations['peak'][s] / max(n_frames, 1)),
+            }
+            for s, stage in enumerate(STAGES)
+        },
+    }
+
+    print(f"Replayed {n_frames} frames x {args.repeats} through {args.model} v{bundle.version}: "
+          f"best {report['total_ms']['min']:.1f} ms, median {report['total_ms']['median']:.1f} ms")
+    print(f"{'stage':10s} {'mean us':>10s} {'median us':>10s} {'p99 us':>10s} {'share':>7s} "
+          f"{'blocks/fr':>10s} {'peak B/fr':>10s}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:10s} {stats['mean_us']:10.1f} {stats['median_us']:10.1f} {stats['p99_us']:10.1f} "
+              f"{stats['share']:7.1%} {stats['alloc_blocks_per_frame']:10.1f} {stats['peak_bytes_per_frame']:10.0f}")
+    if recording:
+        print(f"\nRecording into {recording['directory']}: {recording['written']} frames written, "
+              f"{recording['dropped']} dropped, {recording['record_us']:.1f} us/frame to queue")
+        for label, key in [("predict median", 'predict_median_us'), ("predict p99", 'predict_p99_us'),
+                           ("whole frame median", 'frame_median_us')]:
+            off, on = recording[key]['off'], recording[key]['on']
+            print(f"  {label:18s} {off:10.1f} us without recording, {on:10.1f} us with ({(on - off) / off:+.1%})")
+    print("\nTop allocation sites still held after the replay:")
+    for stat in top_sites[:5]:
+        print(f"  {stat}")
+    if profile_text:
+        print(f"\n{args.profiler} profile:")
+        print(profile_text)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    if baseline['input'] != candidate['input'] or baseline['frames'] != candidate['frames']:
+        print(colored("Warning: the reports were not made on the same input", 'red'))
+    print(f"{baseline['model']} v{baseline['version']} -> {candidate['model']} v{candidate['version']}")
+    for stage in STAGES:
+        before = baseline['stages'][stage]['mean_us']
+        after = candidate['stages'][stage]['mean_us']
+        change = (after - before) / before if before else 0.0
+        print(f"  {stage:10s} {before:10.1f} us -> {after:10.1f} us ({change:+.1%})")
+    before, after = baseline['total_ms']['min'], candidate['total_ms']['min']
+    print(f"  {'total':10s} {before:10.1f} ms -> {after:10.1f} ms ({(after - before) / before:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Replay a capture and profile it')
+    run_parser.add_argument('input', help='Capture CSV, Recorder.py directory or raw serial dump')
+    run_parser.add_argument('--model', default='tubes5-rf')
+    run_parser.add_argument('--version', type=int)
+    run_parser.add_argument('--binary', action='store_true', help='Replay as binary frames instead of text lines')
+    run_parser.add_argument('--frames', type=int, help='Only replay the first N frames')
+    run_parser.add_argument('--warmup', type=int, default=20)
+    run_parser.add_argument('--repeats', type=int, default=3)
+    run_parser.add_argument('--no-gc', action='store_true', help='Disable the garbage collector while timing')
+    run_parser.add_argument('--alloc-frames', type=int, default=50,
+                            help='Frames for which allocation blocks are counted with snapshots')
+    run_parser.add_argument('--profiler', choices=['cprofile', 'sampling', 'none'], default='cprofile')
+    run_parser.add_argument('--interval', type=float, default=0.001, help='Sampling interval in seconds')
+    run_parser.add_argument('--top', type=int, default=20)
+    run_parser.add_argument('--pstats', help='Write the cProfile statistics to this file')
+    run_parser.add_argument('--folded', help='Write folded stacks (flamegraph.pl/speedscope) to this file')
+    run_parser.add_argument('--report', help='Write the timings as JSON for later comparison')
+    run_parser.add_argument('--show-output', action='store_true', help='Print the serving output to the terminal')
+    run_parser.add_argument('--record', metavar='DIR',
+                            help='Also time the replay while recording every frame into DIR with Recorder.py')
+    run_parser.add_argument('--label', default='', help='Label of the recorded frames')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Nearest-neighbour spectral library for identification without retraining.
+
+A library holds labelled reference spectra (e.g. Datalogging/combined.csv,
+AdvancedInterface/combinedData.csv or Tubes5/data.csv), normalised and indexed
+in a KD-tree. A frame is identified by a batched k-NN query that returns the
+labels and distances of the closest references.
+
+Adding references does not rebuild anything: new spectra go into a small
+buffer that is searched by brute force next to the tree, and the tree is only
+rebuilt once the buffer has grown past a fraction of the indexed size.
+
+Usage (from this directory):
+    python SpectralLibrary.py build library.joblib ../ColorUsingTestTubes/Tubes5/data.csv
+    python SpectralLibrary.py add library.joblib new_capture.csv
+    python SpectralLibrary.py query library.joblib frames.csv -k 3
+    python SpectralLibrary.py bench ../ColorUsingTestTubes/Tubes5/data.csv
+"""
+
+import time
+import argparse
+
+import joblib
+import numpy as np
+from sklearn.neighbors import KDTree
+from sklearn.model_selection import train_test_split
+from sklearn.ensemble import RandomForestClassifier
+
+from Captures import load_captures
+
+
+class SpectralLibrary:
+    """Labelled reference spectra with a KD-tree index and incremental inserts."""
+
+    def __init__(self, normalize='l2', leaf_size=40, rebuild_fraction=0.25, min_rebuild=256):
+        # normalize: 'l2' compares spectral shape only, 'standard' scales every channel, 'none' keeps raw counts
+        if normalize not in ('l2', 'standard', 'none'):
+            raise ValueError(f"Unknown normalization {normalize!r}")
+        self.normalize = normalize
+        self.leaf_size = leaf_size
+        self.rebuild_fraction = rebuild_fraction
+        self.min_rebuild = min_rebuild
+
+    def _normalize(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if self.normalize == 'l2':
+            return X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+        if self.normalize == 'standard':
+            return (X - self.mean_) / self.scale_
+        return X
+
+    def build(self, X, labels):
+        """Builds the index from scratch."""
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if self.normalize == 'standard':
+            # Frozen at build time so later inserts stay comparable
+            self.mean_ = X.mean(axis=0)
+            self.scale_ = np.maximum(X.std(axis=0), 1e-12)
+        self._points = self._normalize(X)
+        self._labels = np.asarray(labels, dtype=object)
+        self._tree = KDTree(self._points, leaf_size=self.leaf_size)
+        self._pending_points = np.empty((0, X.shape[1]))
+        self._pending_labels = np.empty(0, dtype=object)
+        return self
+
+    def __len__(self):
+        return len(self._labels) + len(self._pending_labels)
+
+    def add(self, X, labels):
+        """Adds references; they are searchable immediately without a rebuild."""
+        points = self._normalize(X)
+        self._pending_points = np.vstack([self._pending_points, points])
+        self._pending_labels = np.concatenate([self._pending_labels, np.asarray(labels, dtype=object)])
+        if len(self._pending_labels) > max(self.min_rebuild, self.rebuild_fraction * len(self._labels)):
+            self.compact()
+
+    def compact(self):
+        """Merges the insert buffer into the tree."""
+        if len(self._pending_labels) == 0:
+            return
+        self._points = np.vstack([self._points, self._pending_points])
+        self._labels = np.concatenate([self._labels, self._pending_labels])
+        self._tree = KDTree(self._points, leaf_size=self.leaf_size)
+        self._pending_points = self._pending_points[:0]
+        self._pending_labels = self._pending_labels[:0]
+
+    def query(self, X, k=1):
+        """Returns (labels, distances), both of shape (n, k), nearest first."""
+        points = self._normalize(X)
+        k = min(k, len(self))
+
+        distances, indices = self._tree.query(points, k=min(k, len(self._labels)))
+        labels = self._labels[indices]
+
+        if len(self._pending_labels):
+            diff = points[:, None, :] - self._pending_points[None, :, :]
+            pending_distances = np.sqrt(np.einsum('ijk,ijk->ij', diff, diff))
+            distances = np.hstack([distances, pending_distances])
+            labels = np.hstack([labels, np.broadcast_to(self._pending_labels, pending_distances.shape)])
+            order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            labels = np.take_along_axis(labels, order, axis=1)
+
+        return labels, distances
+
+    def predict(self, X, k=1):
+        """Majority label of the k nearest references for every frame, ties going to the nearest."""
+        labels, _ = self.query(X, k=k)
+        if k == 1:
+            return labels[:, 0]
+        predictions = []
+        for row in labels.astype(str):
+            values, first, counts = np.unique(row, return_index=True, return_counts=True)
+            # Ties go to the label whose reference is nearest (query() returns nearest first)
+            tied = counts == counts.max()
+            predictions.append(values[tied][np.argmin(first[tied])])
+        return np.array(predictions, dtype=object)
+
+    def save(self, path):
+        """Saves the references as plain arrays; the tree is rebuilt on load."""
+        state = {
+            'settings': {'normalize': self.normalize, 'leaf_size': self.leaf_size,
+                         'rebuild_fraction': self.rebuild_fraction, 'min_rebuild': self.min_rebuild},
+            'points': self._points,
+            'labels': self._labels.astype(str),
+            'pending_points': self._pending_points,
+            'pending_labels': self._pending_labels.astype(str),
+        }
+        if self.normalize == 'standard':
+            state['mean'] = self.mean_
+            state['scale'] = self.scale_
+        joblib.dump(state, path)
+
+    @classmethod
+    def load(cls, path):
+        state = joblib.load(path)
+        library = cls(**state['settings'])
+        if library.normalize == 'standard':
+            library.mean_ = state['mean']
+            library.scale_ = state['scale']
+        # The points are stored normalised, so they go into the index as they are
+        library._points = state['points']
+        library._labels = state['labels'].astype(object)
+        library._tree = KDTree(library._points, leaf_size=library.leaf_size)
+        library._pending_points = state['pending_points']
+        library._pending_labels = state['pending_labels'].astype(object)
+        return library
+
+
+def benchmark(paths, k=1, repeats=20):
+    """Compares library accuracy and query latency with a RandomForestClassifier."""
+    X, labels = load_captures(paths)
+    labels = labels.astype(str)
+    X_train, X_test, y_train, y_test = train_test_split(X, labels, test_size=0.2, random_state=42)
+
+    start = time.perf_counter()
+    library = SpectralLibrary().build(X_train, y_train)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    forest = RandomForestClassifier(n_estimators=100, random_state=42).fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    def timed(predict, data):
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = predict(data)
+            best = min(best, time.perf_counter() - start)
+        return result, best
+
+    for name, predict in [("Spectral library", lambda data: library.predict(data, k=k)),
+                          ("Random forest", forest.predict)]:
+        y_pred, batch_time = timed(predict, X_test)
+        _, frame_time = timed(predict, X_test[:1])
+        print(f"{name}:")
+        print(f"  Accuracy: {np.mean(y_pred.astype(str) == y_test):.4f}")
+        print(f"  Batch of {len(X_test)}: {batch_time * 1e3:.2f} ms, single frame: {frame_time * 1e3:.3f} ms")
+    print(f"Build time: library {build_time * 1e3:.2f} ms, forest fit {fit_time * 1e3:.2f} ms")
+
+    start = time.perf_counter()
+    library.add(X_test[:1], y_test[:1])
+    print(f"Adding one reference: {(time.perf_counter() - start) * 1e3:.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build a library from labelled captures')
+    build_parser.add_argument('library')
+    build_parser.add_argument('captures', nargs='+')
+    build_parser.add_argument('--normalize', default='l2', choices=['l2', 'standard', 'none'])
+
+    add_parser = subparsers.add_parser('add', help='Add labelled captures to an existing library')
+    add_parser.add_argument('library')
+    add_parser.add_argument('captures', nargs='+')
+
+    query_parser = subparsers.add_parser('query', help='Identify the frames in a capture')
+    query_parser.add_argument('library')
+    query_parser.add_argument('captures', nargs='+')
+    query_parser.add_argument('-k', type=int, default=1)
+
+    bench_parser = subparsers.add_parser('bench', help='Compare with a random forest on a held-out split')
+    bench_parser.add_argument('captures', nargs='+')
+    bench_parser.add_argument('-k', type=int, default=1)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        X, labels = load_captures(args.captures)
+        SpectralLibrary(normalize=args.normalize).build(X, labels).save(args.library)
+        print(f"Library with {len(labels)} references saved to {args.library}")
+    elif args.command == 'add':
+        library = SpectralLibrary.load(args.library)
+        X, labels = load_captures(args.captures)
+        library.add(X, labels)
+        library.save(args.library)
+        print(f"Added {len(labels)} references, library now holds {len(library)}")
+    elif args.command == 'query':
+        library = SpectralLibrary.load(args.library)
+        X, _ = load_captures(args.captures)
+        labels, distances = library.query(X, k=args.k)
+        for row_labels, row_distances in zip(labels, distances):
+            print(", ".join(f"{label} ({distance:.4f})" for label, distance in zip(row_labels, row_distances)))
+    elif args.command == 'bench':
+        benchmark(args.captures, k=args.k)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Linear spectral unmixing for mixed-colour samples (see MixedColor.ino).
+
+Instead of training one class per drop combination ("0G1Y", "1G0Y", "2G1Y", ...),
+the pure captures are used to learn one endmember spectrum per dye plus a
+background spectrum:
+
+    spectrum = background + sum_k amount_k * endmember_k
+
+Every frame is then unmixed with a non-negative least squares fit, which gives the
+amount of each dye directly and also works for mixes that were never captured.
+The NNLS is solved for a whole batch at once: with only a handful of components
+every possible active set is tried with a precomputed pseudo-inverse and the best
+feasible one is kept per frame, so there is no per-frame Python loop.
+
+Usage (from this directory):
+    python Unmixer.py ../BaseTests/AS7265x_Test2_Arduino_Processing_Graph/Processing/Datalogging/Datalogging
+"""
+
+import os
+import re
+import sys
+import time
+import itertools
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from Captures import load_capture
+
+# "2G1Y" -> {'G': 2, 'Y': 1}
+AMOUNT_PATTERN = re.compile(r'(\d+(?:\.\d+)?)([A-Za-z]+)')
+
+
+def parse_amounts(label):
+    """Parses a Datalogging label such as "2G1Y" into {'G': 2.0, 'Y': 1.0}."""
+    amounts = {name: float(value) for value, name in AMOUNT_PATTERN.findall(str(label))}
+    if not amounts:
+        raise ValueError(f"Label {label!r} does not describe any component amounts")
+    return amounts
+
+
+def _active_sets(n_components):
+    """All non-empty subsets of the components, as boolean masks."""
+    masks = []
+    for size in range(1, n_components + 1):
+        for subset in itertools.combinations(range(n_components), size):
+            mask = np.zeros(n_components, dtype=bool)
+            mask[list(subset)] = True
+            masks.append(mask)
+    return masks
+
+
+def nnls_batch(A, B, pinvs=None):
+    """
+    Solves min ||A x - b||, x >= 0 for every row b of B at once.
+
+    A has shape (m, k) and B shape (n, m); returns X with shape (n, k).
+    Meant for small k (2^k - 1 active sets are evaluated).
+    """
+    A = np.asarray(A, dtype=float)
+    B = np.atleast_2d(np.asarray(B, dtype=float))
+    n_components = A.shape[1]
+    masks = _active_sets(n_components)
+    if pinvs is None:
+        pinvs = [np.linalg.pinv(A[:, mask]) for mask in masks]
+
+    # The all-zero solution is always feasible
+    best_x = np.zeros((B.shape[0], n_components))
+    best_err = np.einsum('ij,ij->i', B, B)
+
+    for mask, pinv in zip(masks, pinvs):
+        x_sub = B @ pinv.T  # (n, |mask|)
+        residual = B - x_sub @ A[:, mask].T
+        err = np.einsum('ij,ij->i', residual, residual)
+        better = np.all(x_sub >= 0, axis=1) & (err < best_err)
+        best_err = np.where(better, err, best_err)
+        best_x[better] = 0.0
+        best_x[np.ix_(better, mask)] = x_sub[better]
+
+    return best_x
+
+
+class LinearUnmixer:
+    """Learns endmember spectra from labelled captures and unmixes new frames."""
+
+    def __init__(self, log_space=True):
+        # Unmix -log(intensity) by default: Beer-Lambert makes absorbance linear in the amounts
+        self.log_space = log_space
+
+    def _prepare(self, X):
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        if self.log_space:
+            X = -np.log(np.clip(X, 1e-3, None))
+        return X
+
+    def fit(self, X, labels):
+        """Fits background and endmembers from frames labelled like "2G0Y"."""
+        X = self._prepare(X)
+        parsed = [parse_amounts(label) for label in labels]
+        self.components_ = sorted({name for amounts in parsed for name in amounts})
+        amounts = np.array([[p.get(name, 0.0) for name in self.components_] for p in parsed])
+
+        # Least squares fit of X = [1, amounts] @ [background; endmembers]
+        design = np.hstack([np.ones((len(amounts), 1)), amounts])
+        coef, _, rank, _ = np.linalg.lstsq(design, X, rcond=None)
+        if rank < design.shape[1]:
+            raise ValueError("The captures do not separate the components; add pure samples of each one")
+        self.background_ = coef[0]
+        self.endmembers_ = coef[1:]
+
+        # Weight every channel by its noise level so the bright channels do not dominate
+        residual = X - design @ coef
+        self.channel_weights_ = 1.0 / np.maximum(residual.std(axis=0), 1e-6)
+
+        self._A = (self.endmembers_ * self.channel_weights_).T
+        self._pinvs = [np.linalg.pinv(self._A[:, mask]) for mask in _active_sets(len(self.components_))]
+        return self
+
+    def predict(self, X):
+        """Returns the non-negative amount of every component, shape (n, n_components)."""
+        B = (self._prepare(X) - self.background_) * self.channel_weights_
+        return nnls_batch(self._A, B, self._pinvs)
+
+    def predict_labels(self, X):
+        """Rounds the amounts and formats them like the Datalogging labels ("2G1Y")."""
+        rounded = np.rint(self.predict(X)).astype(int)
+        return np.array([''.join(f'{n}{name}' for n, name in zip(row, self.components_)) for row in rounded])
+
+
+def canonical_label(label, components):
+    """Rewrites a label with the components in a fixed order ("1Y2G" -> "2G1Y")."""
+    amounts = parse_amounts(label)
+    return ''.join(f'{int(amounts.get(name, 0))}{name}' for name in components)
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else '.'
+    pure_labels = ['0G1Y', '1G0Y', '2G0Y']
+    mixed_labels = ['1G1Y', '2G1Y']
+
+    def load(labels):
+        X_parts, label_parts = [], []
+        for label in labels:
+            path = os.path.join(directory, f'{label}.csv')
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                print(f"No capture for {label}, skipping.")
+                continue
+            X, y = load_capture(path)
+            X_parts.append(X)
+            label_parts.append(y)
+        return np.vstack(X_parts), np.concatenate(label_parts)
+
+    X_pure, y_pure = load(pure_labels)
+    X_mixed, y_mixed = load(mixed_labels)
+
+    for log_space in (False, True):
+        unmixer = LinearUnmixer(log_space=log_space).fit(X_pure, y_pure)
+        expected = np.array([canonical_label(label, unmixer.components_) for label in y_mixed])
+
+        start = time.perf_counter()
+        amounts = unmixer.predict(X_mixed)
+        elapsed = time.perf_counter() - start
+        predicted = unmixer.predict_labels(X_mixed)
+
+        print(f"Unmixing in {'log' if log_space else 'intensity'} space, components {unmixer.components_}")
+        for label in np.unique(y_mixed):
+            rows = y_mixed == label
+            print(f"  {label}: mean amounts {np.round(amounts[rows].mean(axis=0), 2)}, "
+                  f"rounded correct {np.mean(predicted[rows] == expected[rows]):.2%}")
+        print(f"  {len(X_mixed)} frames in {elapsed * 1e3:.2f} ms "
+              f"({elapsed / len(X_mixed) * 1e6:.1f} us/frame)")
+
+    # Compare against the per-combination classifier used by Processor.py
+    model_path = os.path.join(directory, 'best_RandomForestClassifier.joblib')
+    if os.path.exists(model_path):
+        model = joblib.load(model_path)
+        X_df = pd.DataFrame(X_mixed)
+        start = time.perf_counter()
+        model.predict(X_df)
+        elapsed = time.perf_counter() - start
+        print(f"RandomForestClassifier: {len(X_mixed)} frames in {elapsed * 1e3:.2f} ms "
+              f"({elapsed / len(X_mixed) * 1e6:.1f} us/frame)")
+
+
+if __name__ == "__main__":
+    main()